@@ -0,0 +1,89 @@
+"""Test the Csv term lookups."""
+
+import unittest
+
+from traiter.terms.csv_ import Csv
+
+
+def make_terms():
+    """Build a few terms."""
+    return Csv(terms=[
+        {'label': 'color', 'pattern': 'red', 'attr': 'lower'},
+        {'label': 'color', 'pattern': 'blue', 'attr': 'lower'},
+        {'label': 'sex', 'pattern': 'female', 'attr': 'lower'},
+        {'label': 'sex', 'pattern': 'f', 'attr': 'text'},
+    ])
+
+
+class TestCsv(unittest.TestCase):
+    """Test the Csv term lookups."""
+
+    def test_terms_01(self):
+        """Terms added to the terms list are found."""
+        terms = make_terms()
+        terms.terms.append({'label': 'color', 'pattern': 'green', 'attr': 'lower'})
+        terms.terms += [{'label': 'color', 'pattern': 'gray', 'attr': 'lower'}]
+        self.assertIsInstance(terms.terms, list)
+        self.assertIs(terms.terms, terms.terms)
+        self.assertEqual(
+            terms.patterns_with_label('color'), ['red', 'blue', 'green', 'gray'])
+
+    def test_terms_02(self):
+        """Appended terms are found."""
+        terms = make_terms()
+        terms.append({'label': 'color', 'pattern': 'green', 'attr': 'lower'})
+        terms.extend([{'label': 'color', 'pattern': 'gray', 'attr': 'lower'}])
+        self.assertEqual(len(terms), 6)
+        self.assertEqual(
+            terms.patterns_with_label('color'), ['red', 'blue', 'green', 'gray'])
+
+    def test_terms_03(self):
+        """Changed fields are found after a reindex."""
+        terms = make_terms()
+        terms.terms[0]['label'] = 'hue'
+        terms.reindex()
+        self.assertEqual(terms.patterns_with_label('hue'), ['red'])
+        self.assertEqual(terms.patterns_with_label('color'), ['blue'])
+
+    def test_drop_01(self):
+        """Dropped terms are not found by any field."""
+        terms = make_terms()
+        terms.drop('red', field='pattern')
+        self.assertEqual(terms.patterns_with_label('color'), ['blue'])
+        self.assertEqual(terms.with_pattern('red'), [])
+        self.assertEqual(
+            [t['pattern'] for t in terms.for_entity_ruler()], ['blue', 'female'])
+
+    def test_drop_02(self):
+        """Dropping most terms compacts the store and keeps the lookups."""
+        terms = make_terms()
+        terms.drop('color sex')
+        self.assertEqual(len(terms), 0)
+        terms.append({'label': 'sex', 'pattern': 'm', 'attr': 'lower'})
+        self.assertEqual(terms.patterns_with_label('sex'), ['m'])
+
+    def test_drop_03(self):
+        """Terms deleted from the terms list are not found."""
+        terms = make_terms()
+        self.assertEqual(terms.patterns_with_label('color'), ['red', 'blue'])
+        del terms.terms[0]
+        terms.terms.insert(0, {'label': 'color', 'pattern': 'green', 'attr': 'lower'})
+        self.assertEqual(terms.patterns_with_label('color'), ['green', 'blue'])
+        self.assertEqual(terms.with_pattern('red'), [])
+
+    def test_terms_04(self):
+        """Setting the terms replaces them."""
+        terms = make_terms()
+        terms.terms = [{'label': 'hue', 'pattern': 'teal', 'attr': 'lower'}]
+        self.assertEqual(terms.patterns_with_label('hue'), ['teal'])
+        self.assertEqual(terms.patterns_with_label('color'), [])
+        self.assertEqual(
+            terms.for_entity_ruler(), [{'label': 'hue', 'pattern': 'teal'}])
+
+    def test_drop_04(self):
+        """Dropping by a field that is not indexed keeps the lookups."""
+        terms = make_terms()
+        terms.terms[1]['replace'] = 'blue'
+        terms.drop('blue', field='replace')
+        self.assertEqual(terms.patterns_with_label('color'), ['red'])
+        self.assertEqual(len(terms), 3)
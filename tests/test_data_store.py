@@ -0,0 +1,114 @@
+"""Test the entity data store."""
+
+import json
+import pickle
+import unittest
+
+import spacy
+
+from traiter.pipes.data_store import DataStore, MISSING, OBJ, SPAN, STR
+from traiter.pipes.entity_data import add_extensions
+
+add_extensions()
+
+
+def build_doc():
+    """Build a doc with data on an entity."""
+    nlp = spacy.blank('en')
+    doc = nlp('big red dog')
+    doc[2:3]._.data['sex'] = 'female'
+    doc[2:3]._.data['length'] = 12.5
+    return doc
+
+
+class TestDataView(unittest.TestCase):
+    """Test the _.data views."""
+
+    def test_copy_01(self):
+        """copy() gives a plain dict."""
+        data = build_doc()[2:3]._.data.copy()
+        self.assertIs(type(data), dict)
+        self.assertEqual(data, {'sex': 'female', 'length': 12.5})
+
+    def test_copy_02(self):
+        """Changing a copy does not change the store."""
+        doc = build_doc()
+        data = doc[2:3]._.data.copy()
+        data['sex'] = 'male'
+        self.assertEqual(doc[2:3]._.data['sex'], 'female')
+
+    def test_copy_03(self):
+        """Copies of rows without data are empty."""
+        self.assertEqual(build_doc()[0:1]._.data.copy(), {})
+
+    def test_json_01(self):
+        """A dict of the view can be written as JSON."""
+        data = json.loads(json.dumps(dict(build_doc()[2:3]._.data)))
+        self.assertEqual(data, {'sex': 'female', 'length': 12.5})
+
+
+class TestDataStore(unittest.TestCase):
+    """Test the sparse columns in the store."""
+
+    def test_sparse_01(self):
+        """Columns only hold the rows that set the field."""
+        store = DataStore()
+        for i in range(100):
+            row = store.row((SPAN, i, i + 1), add=True)
+            store.set(row, f'field_{i % 10}', 'female')
+        self.assertEqual(len(store), 100)
+        self.assertEqual(len(store.columns), 10)
+        self.assertTrue(all(len(c) == 10 for c in store.columns.values()))
+        self.assertEqual(store.strings, ['female'])
+
+    def test_sparse_02(self):
+        """Rows set out of order are found."""
+        store = DataStore()
+        rows = [store.row((SPAN, i, i + 1), add=True) for i in range(5)]
+        for row in reversed(rows):
+            store.set(row, 'n', row * 10)
+        self.assertEqual([store.get(r, 'n') for r in rows], [0, 10, 20, 30, 40])
+
+    def test_sparse_03(self):
+        """Removing the last value of a field removes the column."""
+        store = DataStore()
+        row = store.row((SPAN, 0, 3), add=True)
+        store.set(row, 'sex', 'male')
+        store.set(row, 'sex', MISSING)
+        self.assertIs(store.get(row, 'sex'), MISSING)
+        self.assertEqual(store.columns, {})
+        self.assertEqual(store.fields(row), [])
+
+    def test_types_01(self):
+        """A value of another type makes the column hold any type."""
+        store = DataStore()
+        rows = [store.row((SPAN, i, i + 1), add=True) for i in range(4)]
+        values = ['red', 3, 2.5, True]
+        for row, value in zip(rows, values):
+            store.set(row, 'x', value)
+        self.assertEqual(store.columns['x'].type, OBJ)
+        self.assertEqual([store.get(r, 'x') for r in rows], values)
+        self.assertIs(store.get(rows[3], 'x'), True)
+
+    def test_types_02(self):
+        """Strings are kept as IDs into the string table."""
+        store = DataStore()
+        rows = [store.row((SPAN, i, i + 1), add=True) for i in range(3)]
+        for row, value in zip(rows, ['red', 'blue', 'red']):
+            store.set(row, 'color', value)
+        self.assertEqual(store.columns['color'].type, STR)
+        self.assertEqual(list(store.columns['color'].values), [0, 1, 0])
+
+    def test_pickle_01(self):
+        """A store survives pickling."""
+        store = DataStore()
+        rows = [store.row((SPAN, i, i + 5), add=True) for i in range(3)]
+        store.set(rows[0], 'sex', 'female')
+        store.set(rows[2], 'parts', ['a', 'b'])
+        store.set(rows[1], 'x', 1.5)
+        copy = pickle.loads(pickle.dumps(store))
+        self.assertEqual(copy.rows, store.rows)
+        for row in rows:
+            self.assertEqual(
+                {f: copy.get(row, f) for f in copy.fields(row)},
+                {f: store.get(row, f) for f in store.fields(row)})
@@ -0,0 +1,119 @@
+"""Test getting terms from an ITIS database."""
+
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from traiter.terms import itis
+from traiter.terms.itis import Itis, iter_itis
+
+# (tsn, unit_name1, complete_name, hierarchy_string, vernacular_name)
+ROWS = [
+    (1, 'Felidae', 'Felidae', '202423-1', None),
+    (2, 'Felis', 'Felis catus', '202423-1-2', 'Cat'),
+    (3, 'Felis', 'Felis silvestris', '202423-1-3', 'cat'),
+    (4, 'Lynx', 'Lynx lynx', '202423-1-4', 'lynx'),
+]
+
+# A plant with the same unit name as the cat family, added before the family
+HOMONYM = (50, 'Felidae', 'Felidae', '202422-50', None)
+
+
+def build_db(path: Path, homonym: bool = False) -> None:
+    """Build a tiny ITIS database where two species share a common name."""
+    with sqlite3.connect(path) as cxn:
+        cxn.executescript("""
+            create table taxonomic_units (
+                tsn integer, unit_name1 text, complete_name text,
+                kingdom_id integer, rank_id integer);
+            create table hierarchy (tsn integer, hierarchy_string text);
+            create table vernaculars (tsn integer, vernacular_name text);
+            """)
+        rows = [HOMONYM, *ROWS] if homonym else ROWS
+        for tsn, unit, name, hier, common in rows:
+            kingdom_id = 3 if tsn == HOMONYM[0] else 5
+            rank_id = 140 if unit == 'Felidae' else 220
+            cxn.execute(
+                'insert into taxonomic_units values (?, ?, ?, ?, ?)',
+                (tsn, unit, name, kingdom_id, rank_id))
+            cxn.execute('insert into hierarchy values (?, ?)', (tsn, hier))
+            if common:
+                cxn.execute('insert into vernaculars values (?, ?)', (tsn, common))
+
+
+class TestItis(unittest.TestCase):
+    """Test getting terms from an ITIS database."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.db = Path(self.temp_dir.name) / 'ITIS.sqlite'
+        build_db(self.db)
+        itis.species_names.cache_clear()
+        itis.common_names.cache_clear()
+
+    def tearDown(self):
+        for cxn in itis.CONNECTIONS.values():
+            cxn.close()
+        itis.CONNECTIONS.clear()
+        itis.species_names.cache_clear()
+        itis.common_names.cache_clear()
+        self.temp_dir.cleanup()
+
+    def replacements(self):
+        """Get the common name replacements from both ways of getting them."""
+        batch = [t for t in iter_itis(['Felidae'], replace=True, db=self.db)
+                 if t['label'] == 'common_name']
+        with patch.object(itis, 'ITIS_DB', self.db):
+            single = Itis.itis_common_names('Felidae', replace=True).terms
+        batch = {t['pattern']: t['replace'] for t in batch}
+        single = {t['pattern']: t['replace'] for t in single}
+        return batch, single
+
+    def species(self):
+        """Get the species names from both ways of getting them."""
+        batch = [t['pattern'] for t in iter_itis(['Felidae'], db=self.db)
+                 if t['label'] == 'Felidae']
+        with patch.object(itis, 'ITIS_DB', self.db):
+            single = [t['pattern'] for t in Itis.itis('Felidae').terms]
+        return batch, single
+
+    def test_shared_common_name_01(self):
+        """A shared common name is replaced with the same name both ways."""
+        batch, single = self.replacements()
+        self.assertEqual(batch, {'cat': 'Felis catus', 'lynx': 'Lynx lynx'})
+        self.assertEqual(single, batch)
+
+    def test_shared_common_name_02(self):
+        """The closure index does not change the replacement."""
+        Itis.build_index(self.db)
+        batch, single = self.replacements()
+        self.assertEqual(batch, {'cat': 'Felis catus', 'lynx': 'Lynx lynx'})
+        self.assertEqual(single, batch)
+
+    def test_species_01(self):
+        """The closure index gets the same species as the table scan."""
+        scan = self.species()
+        Itis.build_index(self.db)
+        closure = self.species()
+        expect = ['Felis catus', 'Felis silvestris', 'Lynx lynx']
+        self.assertEqual(scan, (expect, expect))
+        self.assertEqual(closure, scan)
+
+    def test_homonym_01(self):
+        """A homonym resolves to the same taxon both ways."""
+        self.db.unlink()
+        build_db(self.db, homonym=True)
+        batch, single = self.species()
+        self.assertEqual(batch, ['Felis catus', 'Felis silvestris', 'Lynx lynx'])
+        self.assertEqual(single, batch)
+
+    def test_homonym_02(self):
+        """A homonym resolves to the same taxon with the closure index."""
+        self.db.unlink()
+        build_db(self.db, homonym=True)
+        Itis.build_index(self.db)
+        batch, single = self.species()
+        self.assertEqual(batch, ['Felis catus', 'Felis silvestris', 'Lynx lynx'])
+        self.assertEqual(single, batch)
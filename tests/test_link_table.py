@@ -0,0 +1,71 @@
+"""Test the entity link table."""
+
+import pickle
+import unittest
+
+import spacy
+
+from traiter.pipes.data_store import SPAN
+from traiter.pipes.dependency import add_extensions
+from traiter.pipes.link_table import LINKS, MARKER, LinkTable, add_link
+
+add_extensions()
+
+
+def build_doc():
+    """Build a doc with a couple of linked entities."""
+    nlp = spacy.blank('en')
+    doc = nlp('big red dog and small cat')
+    big, dog, cat = doc[0:1], doc[2:3], doc[5:6]
+    add_link(big, dog, 'size_link')
+    add_link(big, cat, 'size_link')
+    return doc
+
+
+class TestLinkTable(unittest.TestCase):
+    """Test the entity link table."""
+
+    def test_links_01(self):
+        """It reads the links from a span."""
+        doc = build_doc()
+        links = doc[0:1]._.links
+        self.assertEqual(links['size_link'], ((8, 11), (22, 25)))
+        self.assertEqual(dict(links), {'size_link': ((8, 11), (22, 25))})
+
+    def test_links_02(self):
+        """Missing link types look empty."""
+        doc = build_doc()
+        self.assertEqual(doc[0:1]._.links['color_link'], ())
+        self.assertNotIn('color_link', doc[0:1]._.links)
+        self.assertEqual(doc[2:3]._.links['size_link'], ())
+
+    def test_links_05(self):
+        """A token does not see the links of a span with the same offsets."""
+        doc = build_doc()
+        self.assertEqual(dict(doc[0]._.links), {})
+        add_link(doc[0], doc[4], 'token_link')
+        self.assertEqual(dict(doc[0]._.links), {'token_link': ((16, 21),)})
+        self.assertEqual(dict(doc[0:1]._.links), {'size_link': ((8, 11), (22, 25))})
+
+    def test_links_03(self):
+        """Appending to the links fails loudly."""
+        doc = build_doc()
+        with self.assertRaisesRegex(TypeError, 'add_link'):
+            doc[0:1]._.links['size_link'].append((4, 7))
+        with self.assertRaisesRegex(TypeError, 'add_link'):
+            doc[2:3]._.links['size_link'].append((4, 7))
+        with self.assertRaisesRegex(TypeError, 'add_link'):
+            doc[2:3]._.links['size_link'] = [(4, 7)]
+
+    def test_links_04(self):
+        """Links survive pickling the table."""
+        doc = build_doc()
+        table = pickle.loads(pickle.dumps(doc.user_data[LINKS]))
+        self.assertEqual(table.links((SPAN, 0, 3))['size_link'], ((8, 11), (22, 25)))
+
+    def test_links_06(self):
+        """Tables written before links had a source kind hold span links."""
+        data = build_doc().user_data[LINKS].to_dict()
+        del data[MARKER]['source_kind']
+        table = LinkTable.from_dict(data)
+        self.assertEqual(table.links((SPAN, 0, 3))['size_link'], ((8, 11), (22, 25)))
@@ -0,0 +1,309 @@
+"""Test options of the old parser against its default behavior."""
+
+import random
+import unittest
+
+from traiter.old.parser import Parser
+from traiter.old.rule import CHAR, HEX, RuleType
+from traiter.old.vocabulary import FIRST, LOWEST, Vocabulary
+
+TEXTS = [
+    '12 and 34',
+    'Total length = 10-20 mm, hf: 3.5 in; ear 7 cm',
+    'colour: red, color blue, coluor green, cooler',
+    'female 12 x 4–5 mm, males 3 feet x 2 ft',
+    'abc word 7 TL 22mm ear: 4.',
+    '',
+]
+
+
+PIECES = [
+    'total length', 'TL', 'hind foot', 'hf', 'ear', '=', ':', ' ', ' ', ';', ',', '12',
+    '3.5', '10-20', '4–5', 'mm', 'cm', 'in', 'feet', 'x', '×', 'male', 'female', 'f',
+    'abc', 'word', '.', '7', ' = ', ', ', '; ', ' mm']
+
+
+def random_texts(count=100, seed=0):
+    """Build texts with long runs of replacer matches."""
+    rnd = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        size = rnd.randint(1, 400)
+        texts.append(' '.join(rnd.choice(PIECES) for _ in range(size)))
+    return texts
+
+
+def fingerprint(tokens):
+    """Get what we compare from the tokens."""
+    return [(t.name, t.span, t.group) for t in tokens]
+
+
+def measurement_rules(producers=False):
+    """Build rules for measurements with several rounds of replacers."""
+    vocab = Vocabulary()
+    vocab.term('metric_len', r' ( milli | centi )? meters? | [cm]m ')
+    vocab.term('imperial_len', r' feet | foot | ft | inch(es)? | in ')
+    vocab.part('number', r' (?<! \d ) \d+ ( \. \d* )? ')
+    vocab.part('dash', r' [\-–] ', capture=False)
+    vocab.part('x', r' [x×] ', capture=False)
+    vocab.term('sex', r' males? | females? | [mf] ')
+    vocab.term('key', r' total \s+ length | tl | hind \s+ foot | hf | ear ')
+    vocab.part('word', r' [a-z]\w* ', priority=LOWEST, capture=False)
+    vocab.part('sep', r' [;,] ', capture=False)
+    vocab.part('eq', r' [=:] ', capture=False)
+    vocab.grouper('len_units', ' metric_len | imperial_len ')
+    vocab.grouper('range', ' number dash number ')
+    vocab.grouper('value', ' range | number ')
+    vocab.grouper('measure', ' value len_units? ')
+    vocab.replacer('dims', ' measure x measure ')
+    vocab.replacer('keyed', ' key eq? measure ')
+    vocab.replacer('keyed_list', ' keyed ( sep keyed )+ ')
+    rules = [vocab.rules[n] for n in 'sex dims keyed keyed_list word sep'.split()]
+    if producers:
+        rules.append(vocab.producer(None, ' sex? measure ', 'trait'))
+        rules.append(vocab.producer(None, ' sex ', 'sex_trait'))
+    return rules
+
+
+class TestPrefilter(unittest.TestCase):
+    """The prefilter must never change the parser's output."""
+
+    def assert_same(self, rules):
+        """Parse the texts with and without the prefilter."""
+        default = Parser(rules)
+        filtered = Parser(rules, prefilter=True)
+        for text in TEXTS:
+            self.assertEqual(
+                fingerprint(filtered.parse(text)), fingerprint(default.parse(text)))
+
+    def test_prefilter_01(self):
+        """It handles ordinary rules."""
+        self.assert_same(measurement_rules())
+
+    def test_prefilter_02(self):
+        """It handles POSIX classes."""
+        vocab = Vocabulary()
+        vocab.part('digits', r' [[:digit:]]+ ')
+        self.assertEqual(len(Parser([vocab['digits']]).parse('12 and 34')), 2)
+        self.assert_same([vocab['digits']])
+
+    def test_prefilter_03(self):
+        """It handles fuzzy matching."""
+        vocab = Vocabulary()
+        vocab.term('colour', r' (?: colour ){e<=1} ')
+        self.assert_same([vocab['colour']])
+
+    def test_prefilter_04(self):
+        """It handles nested sets and set operations."""
+        vocab = Vocabulary()
+        vocab.part('not_x', r' (?V1) [[a-z]--[x]]+ ')
+        vocab.part('and', r' [[:alpha:]&&[a-d]]+ ')
+        self.assert_same([vocab['not_x'], vocab['and']])
+
+
+def blocked_rules():
+    """Build rules where a replacement in one round uncovers a match for the next.
+
+    In the first round "head" beats the overlapping "long" match. That lets "tail"
+    match in the second round, several tokens after the replaced token.
+    """
+    vocab = Vocabulary()
+    for letter in 'abcd':
+        vocab.term(letter, letter)
+    vocab.part('word', r' \w+ ', priority=LOWEST, capture=False)
+    vocab.replacer('head', ' a c ', priority=FIRST)
+    vocab.replacer('long', ' a c c c c c d b b b | d b b b b ')
+    return [vocab.rules[n] for n in 'head long word'.split()]
+
+
+class TestReplaceWindow(unittest.TestCase):
+    """Replacing in windows must give the same tokens as replacing everything."""
+
+    def assert_same(self, rules, texts, window, encoding=HEX):
+        """Parse the texts with and without a replace window."""
+        full = Parser(rules, encoding=encoding)
+        windowed = Parser(rules, encoding=encoding, replace_window=window)
+        for text in texts:
+            self.assertEqual(
+                fingerprint(windowed.parse(text)), fingerprint(full.parse(text)))
+
+    def test_replace_window_01(self):
+        """It works with the smallest allowed window."""
+        self.assert_same(measurement_rules(), TEXTS + random_texts(), 18)
+
+    def test_replace_window_02(self):
+        """It works with a wide window."""
+        self.assert_same(measurement_rules(), TEXTS + random_texts(), 50)
+
+    def test_replace_window_03(self):
+        """It works with the character encoding."""
+        self.assert_same(measurement_rules(), TEXTS + random_texts(), 18, CHAR)
+
+    def test_replace_window_04(self):
+        """It finds matches that a replacement uncovers."""
+        text = 'a c c c c c d b b b b' + ' zz' * 30
+        tokens = Parser(blocked_rules(), replace_window=20).parse(text)
+        self.assertEqual([t.name for t in tokens][:3], ['head', 'c', 'c'])
+        self.assertIn('long', [t.name for t in tokens])
+        self.assert_same(blocked_rules(), [text, text + ' ' + text], 20)
+
+    def test_replace_window_05(self):
+        """It rejects windows that are too small."""
+        parser = Parser(blocked_rules(), replace_window=19)
+        with self.assertRaises(ValueError):
+            parser.parse('a c')
+
+
+class TestLazyMatches(unittest.TestCase):
+    """Matching rules again when their groups are used must not change them."""
+
+    def test_lazy_matches_01(self):
+        """It gives the same tokens as keeping the matches."""
+        eager = Parser(measurement_rules())
+        lazy = Parser(measurement_rules(), lazy_matches=True)
+        for text in TEXTS + random_texts():
+            self.assertEqual(
+                fingerprint(lazy.parse(text)), fingerprint(eager.parse(text)))
+
+    def test_lazy_matches_02(self):
+        """It matches streamed tokens in their window and not the whole text."""
+        text = ' '.join(random_texts(30, seed=3))
+        eager = Parser(measurement_rules())
+        lazy = Parser(measurement_rules(), lazy_matches=True)
+        tokens = list(lazy.parse_stream(text, window=2000, overlap=200))
+        self.assertEqual(
+            fingerprint(tokens),
+            fingerprint(eager.parse_stream(text, window=2000, overlap=200)))
+        scanned = [t for t in tokens if t.rule.type == RuleType.SCANNER]
+        self.assertEqual(
+            [t.match.group() for t in scanned], [text[t.start:t.end] for t in scanned])
+
+
+def tricky_terms():
+    """Build term rules where a single pass could easily go wrong.
+
+    "sea_mammal" has overlapping alternatives, "phrase" beats its first match, two
+    rules match "red" with the same priority, and "kat" must match case variants
+    that are not ASCII.
+    """
+    vocab = Vocabulary()
+    vocab.term('phrase', r' the \s sea ', priority=FIRST)
+    vocab.term('sea_mammal', r' sea \s+ lions? | lions? ')
+    vocab.term('color', r' red | (?: dark \s )? blue ')
+    vocab.term('tint', r' red | pink ', capture=False)
+    vocab.term('kat', r' kat | it ')
+    vocab.term('seal', r' seal ')
+    vocab.part('word', r' \w+ ', priority=LOWEST, capture=False)
+    return [vocab[n] for n in 'phrase sea_mammal color tint kat seal word'.split()]
+
+
+TRICKY = [
+    'the sea lion, sea lions and a lion', 'a sea - lion sealion sea  lions',
+    'red dark blue darkblue pink Red RED', 'KAT \u212aat İt ıt ſeal Seal ß',
+    'the sea the sea lion lion', '',
+]
+
+
+class TestCombineTerms(unittest.TestCase):
+    """Matching all of the term rules in one pass must not change the tokens."""
+
+    def assert_same(self, rules, texts, **kwargs):
+        """Parse the texts with and without combining the term rules."""
+        default = Parser(rules, **kwargs)
+        combined = Parser(rules, combine_terms=True, **kwargs)
+        for text in texts:
+            self.assertEqual(
+                fingerprint(combined.parse(text)), fingerprint(default.parse(text)))
+        return combined
+
+    def test_combine_terms_01(self):
+        """It gives the same tokens for ordinary rules."""
+        parser = self.assert_same(measurement_rules(True), TEXTS + random_texts())
+        self.assertEqual(
+            parser.term_index.names, {'metric_len', 'imperial_len', 'sex', 'key'})
+
+    def test_combine_terms_02(self):
+        """It keeps finditer's overlaps, rule order, and case folding."""
+        parser = self.assert_same(tricky_terms(), TRICKY)
+        self.assertEqual(len(parser.term_index.rules), 6)
+
+    def test_combine_terms_03(self):
+        """It works with lazy matches and the prefilter."""
+        rules = measurement_rules() + tricky_terms()[:-1]  # Both have "word"
+        texts = TRICKY + TEXTS + random_texts(20)
+        self.assert_same(rules, texts, lazy_matches=True)
+        self.assert_same(rules, texts, prefilter=True)
+
+    def test_combine_terms_04(self):
+        """It leaves rules that may not start with a literal word to the regex."""
+        vocab = Vocabulary()
+        vocab.term('any', r' \w+ ')
+        vocab.term('joined', r' red \s* dog ')
+        vocab.term('cased', r' (?-i: Red ) ')
+        vocab.part('part', r' red ')
+        rules = [vocab[n] for n in 'any joined cased part'.split()]
+        parser = self.assert_same(rules, ['red dog reddog Red'])
+        self.assertEqual(parser.term_index.rules, [])
+
+
+class TestParseStream(unittest.TestCase):
+    """Parsing in windows must give the same tokens as parsing the whole text."""
+
+    def assert_same(self, parser, text, window, overlap):
+        """Parse the text whole and in windows."""
+        whole = fingerprint(parser.parse(text))
+        streamed = fingerprint(parser.parse_stream(text, window, overlap))
+        self.assertEqual(streamed, whole)
+
+    def test_parse_stream_01(self):
+        """It gives the same tokens over many windows."""
+        text = ' '.join(random_texts(30, seed=3))
+        self.assert_same(Parser(measurement_rules()), text, 2000, 200)
+
+    def test_parse_stream_02(self):
+        """It gives the same tokens with producers."""
+        text = ' '.join(random_texts(30, seed=3))
+        parser = Parser(measurement_rules(producers=True))
+        self.assertIn('trait', [t.name for t in parser.parse(text)])
+        self.assert_same(parser, text, 2000, 200)
+
+    def test_parse_stream_03(self):
+        """It splits at line breaks and in the middle of words."""
+        text = '\n'.join(random_texts(30, seed=4)).replace(' ', '')
+        self.assert_same(Parser(measurement_rules(producers=True)), text, 500, 100)
+
+    def test_parse_stream_04(self):
+        """It rejects overlaps that are too big."""
+        with self.assertRaises(ValueError):
+            list(Parser(measurement_rules()).parse_stream('12 mm', 100, 50))
+
+
+def reversed_parser():
+    """Build the measurement parser with its rules in another order."""
+    return Parser(list(reversed(measurement_rules())))
+
+
+def other_parser():
+    """Build a parser with rules that the measurement parser does not have."""
+    vocab = Vocabulary()
+    vocab.part('other', r' \d+ ')
+    return Parser([vocab['other']])
+
+
+class TestParseMany(unittest.TestCase):
+    """Parsing in worker processes must give the same tokens as parsing here."""
+
+    def test_parse_many_01(self):
+        """It works with the rules in another order in the workers."""
+        parser = Parser(measurement_rules())
+        texts = TEXTS + random_texts(20)
+        expect = [fingerprint(parser.parse(t)) for t in texts]
+        actual = parser.parse_many(
+            texts, workers=2, chunksize=4, factory=reversed_parser)
+        self.assertEqual([fingerprint(t) for t in actual], expect)
+
+    def test_parse_many_02(self):
+        """It rejects tokens for rules that this parser does not have."""
+        parser = Parser(measurement_rules())
+        with self.assertRaises(ValueError):
+            list(parser.parse_many(['12 mm'], workers=2, factory=other_parser))
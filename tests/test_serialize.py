@@ -0,0 +1,114 @@
+"""Test writing the traiter extensions of a doc."""
+
+import pickle
+import unittest
+
+import spacy
+import srsly
+from spacy.tokens import Doc, DocBin, Span
+
+from traiter.pipes import serialize
+from traiter.pipes.data_store import DATA, FLOAT, INT, OBJ, STR
+from traiter.pipes.dependency import add_extensions as add_link_extensions
+from traiter.pipes.entity_data import add_extensions
+from traiter.pipes.link_table import add_link
+
+add_extensions()
+add_link_extensions()
+
+NLP = spacy.blank('en')
+
+
+def build_doc():
+    """Build a doc with data, labels, and links on its entities and tokens."""
+    doc = NLP('female 12 mm red and male 3.5 cm blue')
+    doc.ents = [
+        Span(doc, 0, 3, label='size'),
+        Span(doc, 3, 4, label='color'),
+        Span(doc, 5, 8, label='size'),
+        Span(doc, 8, 9, label='color'),
+    ]
+    size1, color1, size2, color2 = doc.ents
+
+    size1._.data = {'sex': 'female', 'count': 12, 'length': 12.0, 'value': 'a'}
+    size2._.data = {'sex': 'male', 'count': -(2 ** 40), 'length': 3.5, 'value': 7}
+    color1._.data['value'] = ['x', 'y']
+    color2._.data['value'] = 2.5
+    doc[4]._.data['word'] = 'and'
+
+    size1._.new_label = 'trait'
+    doc[0]._.cached_label = 'sex'
+    doc[5]._.cached_label = 'sex'
+
+    add_link(size1, color1, 'color_link')
+    add_link(size2, color2, 'color_link')
+    add_link(doc[0], size1, 'sex_link')
+    return doc
+
+
+def state(doc):
+    """Get all of the traiter extension values of the doc."""
+    ents = [
+        (e.label_, dict(e._.data), e._.new_label, e._.cached_label, dict(e._.links))
+        for e in doc.ents]
+    tokens = [
+        (dict(t._.data), t._.new_label, t._.cached_label, dict(t._.links))
+        for t in doc]
+    return ents, tokens
+
+
+def copy_ents(doc, other):
+    """Copy the entities of a doc to a doc without them."""
+    other.ents = [Span(other, e.start, e.end, label=e.label_) for e in doc.ents]
+    return other
+
+
+class TestSerialize(unittest.TestCase):
+    """The extensions must survive every way of writing a doc."""
+
+    def setUp(self):
+        self.doc = build_doc()
+        self.expect = state(self.doc)
+
+    def test_columns_01(self):
+        """The doc has str, int, float, and mixed columns."""
+        columns = self.doc.user_data[DATA].columns
+        types = {f: c.type for f, c in columns.items()}
+        self.assertEqual(types, {
+            'sex': STR, 'count': INT, 'length': FLOAT, 'value': OBJ, 'word': STR})
+
+    def test_doc_bytes_01(self):
+        """They survive Doc.to_bytes and Doc.from_bytes."""
+        doc = Doc(NLP.vocab).from_bytes(self.doc.to_bytes())
+        self.assertEqual(state(doc), self.expect)
+
+    def test_doc_bin_01(self):
+        """They survive a DocBin that stores user data."""
+        doc_bin = DocBin(store_user_data=True)
+        doc_bin.add(self.doc)
+        docs = DocBin().from_bytes(doc_bin.to_bytes()).get_docs(NLP.vocab)
+        self.assertEqual(state(next(docs)), self.expect)
+
+    def test_pickle_01(self):
+        """They survive pickling the doc, like nlp.pipe(n_process=N) does."""
+        doc = pickle.loads(pickle.dumps(self.doc))
+        self.assertEqual(state(doc), self.expect)
+
+    def test_serialize_01(self):
+        """They survive serialize.to_bytes and serialize.from_bytes."""
+        doc = Doc(NLP.vocab, words=[t.text for t in self.doc])
+        doc = serialize.from_bytes(doc, serialize.to_bytes(self.doc))
+        self.assertEqual(state(copy_ents(self.doc, doc)), self.expect)
+
+    def test_serialize_02(self):
+        """A doc without traiter state reads back empty."""
+        doc = NLP('red')
+        other = serialize.from_bytes(NLP('red'), serialize.to_bytes(doc))
+        self.assertEqual(dict(other.user_data), {})
+        self.assertEqual(state(other), state(doc))
+
+    def test_serialize_03(self):
+        """Unknown state versions are an error."""
+        data = srsly.msgpack_dumps({'version': serialize.VERSION + 1, 'state': {}})
+        with self.assertRaises(ValueError):
+            serialize.from_bytes(NLP('red'), data)
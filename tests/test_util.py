@@ -0,0 +1,109 @@
+"""Test the shared utilities."""
+
+import math
+import random
+import string
+import unittest
+
+import ftfy
+import numpy as np
+import regex as re
+
+from traiter.util import (
+    clean_text, clean_texts, to_positive_float, to_positive_floats, to_positive_int,
+    to_positive_ints)
+
+NUMBERS = [
+    None, '', '5.', '.5', '1.2.3', '1/2', '٣', '١٢.٥', '12 mm', '3.5 cm.', 'e', '.',
+    '9' * 19, '1' * 30, '0' * 30 + '7', '9223372036854775807', '9223372036854775808',
+    '1e5', 'nan', '1_000', '１２',
+]
+
+
+class TestPositiveNumbers(unittest.TestCase):
+    """The batch conversions must agree with the scalar ones."""
+
+    def test_floats_01(self):
+        """to_positive_floats() gives NaN where to_positive_float() gives None."""
+        floats = to_positive_floats(NUMBERS)
+        self.assertEqual(floats.dtype, np.float64)
+        for value, batch in zip(NUMBERS, floats):
+            scalar = to_positive_float(value)
+            with self.subTest(value=value):
+                if scalar is None:
+                    self.assertTrue(math.isnan(batch))
+                else:
+                    self.assertEqual(batch, scalar)
+
+    def test_ints_01(self):
+        """to_positive_ints() is masked where to_positive_int() gives None."""
+        ints = to_positive_ints(NUMBERS)
+        self.assertEqual(ints.dtype, object)  # Some values do not fit in an int64
+        for value, batch in zip(NUMBERS, ints):
+            scalar = to_positive_int(value)
+            with self.subTest(value=value):
+                if scalar is None:
+                    self.assertIs(batch, np.ma.masked)
+                else:
+                    self.assertEqual(batch, scalar)
+                    self.assertIs(type(batch), int)
+
+    def test_ints_02(self):
+        """Values that fit in an int64 give an int64 array."""
+        values = [v for v in NUMBERS if not v or len(v) < 19]
+        ints = to_positive_ints(values)
+        self.assertEqual(ints.dtype, np.int64)
+        expect = [to_positive_int(v) for v in values]
+        self.assertEqual([None if i is np.ma.masked else i for i in ints], expect)
+
+    def test_empty_01(self):
+        """Empty input gives empty arrays."""
+        self.assertEqual(len(to_positive_floats([])), 0)
+        self.assertEqual(len(to_positive_ints([])), 0)
+
+
+TEXTS = [
+    '', 'Plain ASCII text, 12 mm; ok?', 'tabs\tand\nnewlines', 'crlf\r\nline\rbreaks',
+    'form\ffeed', 'fish &amp; chips &lt;b&gt;', 'AT&T', '\x1b[31mred\x1b[0m',
+    'bell\x07 and \x0b vertical tab', 'cafÃ© NiÃ±o â€œquotedâ€\x9d', 'Ã¢â‚¬â„¢',
+    'uÌˆber', '\ufeffBOM', 'ﬁne ligature', 'full ｗｉｄｔｈ', 'ellipsis…', 'caf\u0065\u0301',
+]
+
+
+def ftfy_always(text):
+    """Clean the text like clean_text() but always run ftfy."""
+    text = text.replace('\f', '\n\n')
+    text = ftfy.fix_text(text)
+    return re.sub(r'\p{Cc}+', ' ', text)
+
+
+class TestCleanText(unittest.TestCase):
+    """Skipping ftfy for text it cannot change must not change the result."""
+
+    def test_clean_text_01(self):
+        """It matches always running ftfy."""
+        for text in TEXTS:
+            with self.subTest(text=text):
+                self.assertEqual(clean_text(text), ftfy_always(text))
+
+    def test_clean_text_02(self):
+        """It matches always running ftfy on random ASCII."""
+        rnd = random.Random(0)
+        chars = string.printable + '\x00\x1b\x7f'
+        for _ in range(2000):
+            text = ''.join(rnd.choice(chars) for _ in range(rnd.randint(0, 30)))
+            self.assertEqual(clean_text(text), ftfy_always(text), repr(text))
+
+    def test_clean_texts_01(self):
+        """Remembering cleaned texts keeps them in order."""
+        texts = [TEXTS[i % 5] for i in range(20)] + TEXTS
+        expect = [clean_text(t) for t in texts]
+        self.assertEqual(list(clean_texts(texts, memo=True)), expect)
+        self.assertEqual(list(clean_texts(iter(texts), memo=True)), expect)
+
+    def test_clean_texts_02(self):
+        """Workers that remember cleaned texts keep them in order."""
+        texts = [TEXTS[i % 7] for i in range(50)]
+        expect = [clean_text(t) for t in texts]
+        cleaned = clean_texts(texts, workers=2, memo=True, chunksize=3)
+        self.assertEqual(list(cleaned), expect)
@@ -0,0 +1,108 @@
+"""Test the on-disk vocabulary cache."""
+
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from traiter.terms import vocab_cache
+from traiter.terms.csv_ import Csv, SHARED_CSV
+
+PATHS = SHARED_CSV[:1]
+
+# Build a derived term set in another process
+OTHER_PROCESS = """
+import sys
+from pathlib import Path
+from traiter.terms import vocab_cache
+from traiter.terms.csv_ import Csv
+vocab_cache.VOCAB_CACHE_DIR = Path(sys.argv[1])
+base = Csv.read_csv(sys.argv[2])
+Csv.hyphenate_terms(base, cache=True)
+"""
+
+
+def read_shared():
+    """Read the test terms, a named build function."""
+    return Csv.read_csv(PATHS)
+
+
+class TestVocabCache(unittest.TestCase):
+    """Test the on-disk vocabulary cache."""
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.cache_dir = Path(self.temp_dir.name)
+        self.patch = patch.object(vocab_cache, 'VOCAB_CACHE_DIR', self.cache_dir)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.temp_dir.cleanup()
+
+    def cache_files(self):
+        """Get the names of the cache files."""
+        return sorted(p.name for p in self.cache_dir.glob('*.vocab'))
+
+    def test_cached_01(self):
+        """A lambda build needs params."""
+        with self.assertRaises(ValueError):
+            Csv.cached(PATHS, lambda: Csv.read_csv(PATHS))
+
+    def test_cached_02(self):
+        """A named build function does not need params."""
+        for _ in range(2):
+            terms = Csv.cached(PATHS, read_shared)
+            self.assertEqual(list(terms), list(read_shared()))
+        self.assertEqual(len(self.cache_files()), 1)
+
+    def test_derived_01(self):
+        """A derived term set reuses its cache file."""
+        expect = list(Csv.hyphenate_terms(Csv.read_csv(PATHS)))
+        for _ in range(2):
+            base = Csv.read_csv(PATHS)
+            terms = Csv.hyphenate_terms(base, cache=True)
+            self.assertEqual(list(terms), expect)
+        self.assertEqual(len(self.cache_files()), 1)
+
+    def test_derived_02(self):
+        """A derived term set has the same key in every process."""
+        base = Csv.read_csv(PATHS)
+        Csv.hyphenate_terms(base, cache=True)
+        files = self.cache_files()
+        subprocess.run(
+            [sys.executable, '-c', OTHER_PROCESS, str(self.cache_dir), str(PATHS[0])],
+            check=True)
+        self.assertEqual(self.cache_files(), files)
+
+    def test_derived_03(self):
+        """Different derivation params get different cache files."""
+        base = Csv.read_csv(PATHS)
+        labels = sorted({t['label'] for t in base})[:2]
+        for label in labels:
+            terms = Csv.trailing_dash(base, label, cache=True)
+            self.assertEqual(list(terms), list(Csv.trailing_dash(base, label)))
+        self.assertEqual(len(self.cache_files()), 2)
+
+    def test_derived_04(self):
+        """Chained derivations know their recipes."""
+        base = Csv.read_csv(PATHS, cache=True)
+        label = next(iter(base))['label']
+        dashed = Csv.trailing_dash(Csv.hyphenate_terms(base), label, cache=True)
+        self.assertEqual(
+            dashed.recipe,
+            ['trailing_dash',
+             ['hyphenate_terms', ['read_csv', None], {}],
+             {'label': label}])
+        self.assertEqual(dashed.sources, PATHS)
+
+    def test_derived_05(self):
+        """Changed term sets are not cached."""
+        base = Csv.read_csv(PATHS)
+        base.terms.append({'label': 'color', 'pattern': 'teal', 'attr': 'lower'})
+        self.assertIsNone(base.recipe)
+        terms = Csv.hyphenate_terms(base, cache=True)
+        self.assertEqual(list(terms), list(Csv.hyphenate_terms(base)))
+        self.assertEqual(self.cache_files(), [])
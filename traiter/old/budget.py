@@ -0,0 +1,66 @@
+"""Limit how long the rule regexes may run on a text.
+
+A garbled text can make a regex backtrack for minutes. The regex module can stop a
+search after a timeout so we give each rule a time limit and each parse a total time
+limit. When a limit runs out we skip the rest of that rule's matches, record what
+happened, and keep going.
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional, Pattern
+
+from .rule import Rule
+
+
+@dataclass
+class Timeout:
+    """A rule that ran out of time."""
+
+    text: str  # The text being parsed
+    rule: str  # The rule name
+    elapsed: float  # Seconds spent on the rule before giving up
+
+
+Report = Callable[[Timeout], None]
+
+
+class Budget:
+    """The time limits for parsing one text."""
+
+    def __init__(
+            self,
+            text: str,
+            report: Report,
+            timeout: Optional[float] = None,
+            parse_timeout: Optional[float] = None,
+    ) -> None:
+        self.text = text
+        self.report = report
+        self.timeout = timeout
+        self.deadline = None
+        self.timed_out = False  # Did any rule run out of time?
+        if parse_timeout is not None:
+            self.deadline = time.perf_counter() + parse_timeout
+
+    def finditer(
+            self, rule: Rule, regexp: Pattern, string: str, pos: int = 0
+    ) -> Iterator:
+        """Find the rule's matches in the string until the rule runs out of time."""
+        timeout = self.timeout
+        start = time.perf_counter()
+
+        if self.deadline is not None:
+            left = self.deadline - start
+            if left <= 0.0:
+                self.timed_out = True
+                self.report(Timeout(self.text, rule.name, 0.0))
+                return
+            timeout = left if timeout is None else min(timeout, left)
+
+        try:
+            yield from regexp.finditer(string, pos, timeout=timeout)
+        except TimeoutError:
+            self.timed_out = True
+            elapsed = time.perf_counter() - start
+            self.report(Timeout(self.text, rule.name, elapsed))
@@ -0,0 +1,91 @@
+"""Remember the tokens for texts that the parser has already seen.
+
+Field note columns repeat a lot. Texts like "adult" or "in alcohol" show up
+thousands of times so we keep the tokens for the most recently used texts. The
+cache is limited by the number of texts and by an estimate of the memory used.
+
+The cache hands out copies of the tokens so that callers cannot change the cached
+ones.
+"""
+
+import copy
+import sys
+from collections import OrderedDict
+from typing import Optional
+
+from .token import Token, Tokens
+
+# A rough size of a token object without its groups
+TOKEN_BYTES = 200
+
+
+class ParseCache:
+    """A least recently used cache of parse results keyed by text."""
+
+    def __init__(self, size: int, max_bytes: Optional[int] = None) -> None:
+        self.size = size  # The most texts to keep
+        self.max_bytes = max_bytes  # The most memory to use, approximately
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries: OrderedDict[str, tuple[Tokens, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, text: str) -> Optional[Tokens]:
+        """Get a copy of the tokens for a text or None if it is not cached."""
+        entry = self.entries.get(text)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(text)
+        return copy_tokens(entry[0])
+
+    def put(self, text: str, tokens: Tokens) -> None:
+        """Cache a copy of the tokens for a text."""
+        if self.size <= 0:
+            return
+
+        nbytes = size_of(text, tokens)
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return
+
+        if text in self.entries:
+            self.bytes -= self.entries.pop(text)[1]
+
+        self.entries[text] = (copy_tokens(tokens), nbytes)
+        self.bytes += nbytes
+
+        while len(self.entries) > self.size or (
+                self.max_bytes is not None and self.bytes > self.max_bytes):
+            _, (_, old_bytes) = self.entries.popitem(last=False)
+            self.bytes -= old_bytes
+
+    def clear(self) -> None:
+        """Remove all cached texts, the hit and miss counts are kept."""
+        self.entries.clear()
+        self.bytes = 0
+
+
+def copy_tokens(tokens: Tokens) -> Tokens:
+    """Copy tokens so that changing the copies leaves the originals alone."""
+    copies = []
+    for token in tokens:
+        new = Token(token.rule, group=copy.deepcopy(token.group), span=token.span)
+        new.match = token.match
+        copies.append(new)
+    return copies
+
+
+def size_of(text: str, tokens: Tokens) -> int:
+    """Estimate the memory used by a cache entry."""
+    nbytes = sys.getsizeof(text)
+    for token in tokens:
+        nbytes += TOKEN_BYTES
+        for key, value in token.group.items():
+            nbytes += sys.getsizeof(key) + sys.getsizeof(value)
+            if isinstance(value, list):
+                nbytes += sum(sys.getsizeof(v) for v in value)
+    return nbytes
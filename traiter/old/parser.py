@@ -1,31 +1,118 @@
 """Extract information for further analysis."""
 
+import multiprocessing
 from collections import deque
-from typing import Union
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional, Pattern, Union
 
 from traiter.util import flatten
-from .rule import RuleDict, RuleType, Rules, SIZE
-from .token import Groups, Token, Tokens
+from .budget import Budget, Report, Timeout
+from .parse_cache import ParseCache
+from .prefilter import Prefilter, max_width
+from .rule import (
+    DEFINED, ENCODINGS, EXPANSIONS, HEX, INLINE, Rule, RuleDict, RuleType, Rules,
+    compile_pattern, dependencies)
+from .term_index import Matches, TermIndex
+from .token import Groups, Token, Tokens, TokenStream, Window
 
 RulesInput = Union[Rules, list[Rules]]
 
+# Tokens sent back from worker processes: (rule name, span, groups)
+Packed = list[tuple[str, tuple[int, int], Groups]]
+
+# How many of the latest rule timeouts the parser keeps
+MAX_TIMEOUTS = 1000
+
+# Default window and overlap sizes, in characters, for streaming long texts
+WINDOW = 20_000
+OVERLAP = 1_000
+
 
 class Parser:
     """Parser arrays and functionality."""
 
-    def __init__(self, rules: RulesInput, name: str = 'parser') -> None:
-        """Build the parser."""
+    def __init__(
+            self,
+            rules: RulesInput,
+            name: str = 'parser',
+            replace_window: Optional[int] = None,
+            encoding: str = HEX,
+            expansion: str = INLINE,
+            prefilter: bool = False,
+            timeout: Optional[float] = None,
+            parse_timeout: Optional[float] = None,
+            on_timeout: Optional[Report] = None,
+            cache_size: int = 0,
+            cache_bytes: Optional[int] = None,
+            lazy_matches: bool = False,
+            combine_terms: bool = False,
+    ) -> None:
+        """Build the parser.
+
+        encoding       = How tokens are written for groupers etc., see ENCODINGS
+        expansion      = How groupers are written into other rules, see EXPANSIONS
+        prefilter      = Only run the scanners that could match the text, see
+                         prefilter.py. Use this to cut the scan time when there
+                         are many scanner rules
+        timeout        = The seconds a rule's regex may run on one text
+        parse_timeout  = The seconds all of the rule regexes may run on one text
+        on_timeout     = Called with a Timeout when a rule runs out of time. The
+                         latest ones are also kept in parser.timeouts
+        cache_size     = Remember the tokens for this many of the most recently
+                         parsed texts. 0 = no cache, see parse_cache.py
+        cache_bytes    = The approximate most memory the cache may use
+        replace_window = After the first round of replacements only rescan this
+                         many tokens on either side of a replaced token. It must be
+                         at least twice the most tokens a replacer can match, the
+                         parser checks this when it is built. Replacers that can
+                         match any number of tokens are always rescanned in full.
+                         None = rescan all of the tokens every round
+        lazy_matches   = Do not keep the regex matches of rules. Kept tokens match
+                         their rules again when their groups are used. This uses
+                         less memory on long texts but parsing is slower, see
+                         TokenStream
+        combine_terms  = Find the matches of all of the term rules made of literal
+                         words in one pass over the text, see term_index.py. Use
+                         this when there are many term rules. These rules do not
+                         use the time budget
+        """
+        if encoding not in ENCODINGS:
+            raise ValueError(f'Unknown encoding "{encoding}"')
+        if expansion not in EXPANSIONS:
+            raise ValueError(f'Unknown expansion "{expansion}"')
         self.name: str = name
+        self.replace_window: Optional[int] = replace_window
+        self.encoding: str = encoding
+        self.size: int = ENCODINGS[encoding]  # The length of a token in token text
+        self.expansion: str = expansion
+        self.use_prefilter: bool = prefilter
+        self.lazy_matches: bool = lazy_matches
+        self.combine_terms: bool = combine_terms
+        self.timeout: Optional[float] = timeout
+        self.parse_timeout: Optional[float] = parse_timeout
+        self.on_timeout: Optional[Report] = on_timeout
+        self.timeouts: deque[Timeout] = deque(maxlen=MAX_TIMEOUTS)
+        self.budget: Optional[Budget] = None
+        self.regexps: dict[str, Pattern] = {}  # This parser's compiled rules
+        self.cache: Optional[ParseCache] = None
+        if cache_size > 0:
+            self.cache = ParseCache(cache_size, cache_bytes)
         self.rules: RuleDict = {}
         self._built = False
         self.scanners: Rules = []
+        self.searched: Rules = []  # Scanners that are run one at a time
         self.replacers: Rules = []
         self.producers: Rules = []
+        self.unbounded: set[str] = set()  # Replacers without a longest match
+        self.prefilter: Optional[Prefilter] = None
+        self.term_index: Optional[TermIndex] = None
         self.__add__(rules)
 
     def __add__(self, rule_list: list[Rules]) -> None:
         """Add rules to the parser."""
         self._built = False
+        if self.cache is not None:
+            self.cache.clear()
         for rule in sorted(flatten(rule_list)):
             if rule.name in self.rules:
                 if rule != self.rules[rule.name]:
@@ -38,11 +125,24 @@ class Parser:
         if not self._built:
             self.build()
 
+        if self.cache is not None:
+            tokens = self.cache.get(text)
+            if tokens is not None:
+                return tokens
+
+        self.budget = None
+        if self.timeout is not None or self.parse_timeout is not None:
+            self.budget = Budget(
+                text, self.report_timeout, self.timeout, self.parse_timeout)
+
         tokens = self.scan(text)
 
-        again = bool(self.replacers)
-        while again:
-            tokens, again = self.replace(tokens, text)
+        if self.replacers and self.replace_window is not None:
+            tokens = self.replace_incremental(tokens, text)
+        else:
+            again = bool(self.replacers)
+            while again:
+                tokens, again = self.replace(tokens, text)
 
         # for token in tokens:
         #     print(token)
@@ -51,8 +151,102 @@ class Parser:
         if self.producers:
             tokens = self.produce(tokens, text)
 
+        # Do not remember tokens from a parse that ran out of time
+        if self.cache is not None and not (self.budget and self.budget.timed_out):
+            self.cache.put(text, tokens)
+
         return tokens
 
+    def parse_stream(
+            self, text: str, window: int = WINDOW, overlap: int = OVERLAP
+    ) -> Iterator[Token]:
+        """Parse a long text in overlapping windows and yield the tokens.
+
+        Only one window of scanner tokens is held at a time. Windows end at a line
+        break or a space when there is one. A token is taken from the window where
+        it starts before the middle of the overlap with the next window, so a
+        rule's matches should be shorter than half of the overlap.
+
+        Token spans are for the whole text. The regex matches of scanner tokens are
+        still for the window.
+        """
+        if overlap >= window // 2:
+            raise ValueError('The overlap must be less than half of the window')
+
+        start, low, last_end = 0, 0, 0
+        while True:
+            end = len(text)
+            if start + window < end:
+                end = boundary(text, start + window, start + window // 2)
+            final = end == len(text)
+
+            high = end
+            if not final:
+                next_start = boundary(text, end - overlap, start + 1)
+                high = (next_start + end) // 2
+
+            for token in self.parse(text[start:end]):
+                token.span = (token.start + start, token.end + start)
+                if low <= token.start < high and token.start >= last_end:
+                    last_end = token.end
+                    yield token
+
+            if final:
+                return
+            start, low = next_start, high
+
+    def parse_many(
+            self,
+            texts: Iterable[str],
+            workers: int = 1,
+            chunksize: int = 64,
+            factory: Optional[Callable[[], 'Parser']] = None,
+    ) -> Iterator[Tokens]:
+        """Parse many texts, in order, using several processes.
+
+        Rule actions are often lambdas or closures which cannot be pickled so we
+        cannot send the parser to the workers. Either give a factory function,
+        that can be pickled, to build the parser in each worker or we will fork
+        the workers with a copy of this parser.
+
+        Tokens from the workers do not have regex match objects. They are matched to
+        this parser's rules by name.
+
+        texts     = An iterable of strings, it is consumed lazily
+        workers   = The number of worker processes. 1 = parse in this process
+        chunksize = How many texts to send to a worker at a time
+        factory   = Builds a parser with the same rules as this parser
+        """
+        if workers <= 1:
+            yield from (self.parse(t) for t in texts)
+            return
+
+        if not self._built:
+            self.build()
+
+        if factory:
+            context = multiprocessing.get_context()
+        elif 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            raise ValueError('A parser factory is required on this platform')
+
+        global WORKER_PARSER  # pylint: disable=global-statement
+        WORKER_PARSER = self
+        rules = self.rules
+
+        with context.Pool(workers, init_worker, (factory,)) as pool:
+            pending = deque()
+            texts = iter(texts)
+            while chunk := list(islice(texts, chunksize)):
+                pending.append(pool.apply_async(parse_chunk, (chunk,)))
+                if len(pending) >= 2 * workers:  # Bound the work in flight
+                    yield from unpack(rules, pending.popleft().get())
+            while pending:
+                yield from unpack(rules, pending.popleft().get())
+
+        WORKER_PARSER = None
+
     def build(self) -> None:
         """Build the regular expressions."""
         self._built = True
@@ -60,19 +254,65 @@ class Parser:
             r for r in sorted(self.rules.values()) if r.type == RuleType.SCANNER
         ]
 
+        self.searched = self.scanners
+        if self.combine_terms:
+            self.term_index = TermIndex(self.scanners)
+            combined = self.term_index.names
+            self.searched = [r for r in self.scanners if r.name not in combined]
+
+        if self.use_prefilter:
+            self.prefilter = Prefilter(self.searched)
+
         rules = [r for r in sorted(self.rules.values()) if r.type != RuleType.SCANNER]
-        for rule in rules:
-            rule.compile(self.rules)
-            if rule.type == RuleType.PRODUCER:
-                self.producers.append(rule)
-            elif rule.type == RuleType.REPLACER:
-                self.replacers.append(rule)
+        self.producers = [r for r in rules if r.type == RuleType.PRODUCER]
+        self.replacers = [r for r in rules if r.type == RuleType.REPLACER]
+        self.compile(self.producers + self.replacers)
+
+        if self.replace_window is not None:
+            self.check_replace_window()
+
+    def check_replace_window(self) -> None:
+        """Make sure the replace window is wide enough for the replacers."""
+        self.unbounded = set()
+        longest = 0
+        for rule in self.replacers:
+            width = max_width(self.regexps[rule.name].pattern)
+            if width is None:
+                self.unbounded.add(rule.name)
+            else:
+                longest = max(longest, -(-width // self.size))
+        if self.replace_window < 2 * longest:
+            raise ValueError(
+                f'The replace_window must be at least {2 * longest}, twice the '
+                f'most tokens a replacer can match')
+
+    def compile(self, roots: Rules) -> None:
+        """Compile the rules and only the groupers that they use.
+
+        Rules may be shared with other parsers that build them differently, so we
+        keep our own compiled regexes. Compiled regexes are cached for the whole
+        process so parsers that build rules the same way share them.
+        """
+        self.regexps = {}
+        patterns = {}
+        for rule in dependencies([r.name for r in roots], self.rules):
+            if rule.type == RuleType.SCANNER:
+                continue
+            pattern = rule.build(self.rules, self.encoding, self.expansion, patterns)
+            patterns[rule.name] = pattern
+            rule.regexp = self.regexps[rule.name] = compile_pattern(pattern)
 
     def scan(self, text: str) -> Tokens:
         """Scan a string & return tokens."""
         tokens = []
-        matches = self.get_matches(self.scanners, text)
-        matches = self.sort_matches(matches)
+        rules = self.prefilter.filter(text) if self.prefilter else self.searched
+        found = {}
+        if self.term_index:
+            # Put the term rules back in rule order, it breaks ties when sorting
+            found = self.term_index.find(text)
+            names = {r.name for r in rules} | found.keys()
+            rules = [r for r in self.scanners if r.name in names]
+        matches = self.best_matches(rules, text, found=found)
 
         while matches:
             token = matches.popleft()
@@ -84,7 +324,7 @@ class Parser:
     def produce(self, tokens: Tokens, text: str) -> Tokens:
         """Produce final tokens for consumption by the client code."""
         results = []
-        token_text = ''.join(t.rule.token for t in tokens)
+        token_text = self.token_text(tokens)
         matches = self.match_tokens(self.producers, token_text)
 
         while matches:
@@ -94,12 +334,73 @@ class Parser:
 
         return results
 
-    @staticmethod
-    def get_matches(rules: Rules, text: str) -> Tokens:
+    def get_matches(self, rules: Rules, text: str) -> Tokens:
         """Get all of the text matches for the rules sorted by position."""
-        pairs = [(r, r.regexp.finditer(text)) for r in rules]
+        pairs = [(r, self.finditer(r, text)) for r in rules]
         return [Token(match[0], match=m) for match in pairs for m in match[1]]
 
+    def best_matches(
+            self,
+            rules: Rules,
+            text: str,
+            size: Optional[int] = None,
+            windows: Optional[dict[str, list[Window]]] = None,
+            found: Optional[Matches] = None,
+    ) -> deque:
+        """Get tokens for the best non-overlapping matches of the rules.
+
+        With lazy_matches this only keeps the spans of the matches, see TokenStream.
+
+        size    = Only keep matches that start on a token boundary
+        windows = Only keep matches that start in these character spans. By rule
+                  name, None = the whole text
+        found   = The matches of rules that were already found, by rule name
+        """
+        everything = [(0, len(text))]
+        windows = windows if windows else {}
+        found = found if found else {}
+
+        if self.lazy_matches:
+            stream = TokenStream(rules)
+            for i, rule in enumerate(rules):
+                if rule.name in found:
+                    stream.scan(i, found[rule.name], size)
+                    continue
+                for lo, hi in windows.get(rule.name, everything):
+                    stream.scan(i, self.finditer(rule, text, lo), size, hi)
+            return deque(stream.best(text, self.rematch))
+
+        matches = []
+        for rule in rules:
+            if rule.name in found:
+                matches += [Token(rule, match=m) for m in found[rule.name]]
+                continue
+            for lo, hi in windows.get(rule.name, everything):
+                for match in self.finditer(rule, text, lo):
+                    if match.start() >= hi:
+                        break
+                    matches.append(Token(rule, match=match))
+        if size is not None and size > 1:
+            matches = [t for t in matches if t.start % size == 0]
+        return self.sort_matches(matches)
+
+    def rematch(self, rule: Rule, text: str, pos: int):
+        """Match a rule at a position where we already know it matches."""
+        return self.regexps.get(rule.name, rule.regexp).match(text, pos)
+
+    def finditer(self, rule: Rule, text: str, pos: int = 0) -> Iterator:
+        """Find the rule's matches, within the time budget if there is one."""
+        regexp = self.regexps.get(rule.name, rule.regexp)
+        if self.budget:
+            return self.budget.finditer(rule, regexp, text, pos)
+        return regexp.finditer(text, pos)
+
+    def report_timeout(self, timeout: Timeout) -> None:
+        """Record a rule that ran out of time."""
+        self.timeouts.append(timeout)
+        if self.on_timeout:
+            self.on_timeout(timeout)
+
     def sort_matches(self, tokens: Tokens) -> deque:
         """Sort the matches by starting span and when and then by longest."""
         matches = deque(
@@ -108,11 +409,15 @@ class Parser:
         matches = self.remove_overlapping(matches)
         return matches
 
+    def token_text(self, tokens: Tokens) -> str:
+        """Write the tokens as a string for groupers etc. to match against."""
+        if self.size == 1:
+            return ''.join([t.rule.char for t in tokens])
+        return ''.join([t.rule.token for t in tokens])
+
     def match_tokens(self, rules: Rules, text: str) -> deque:
         """Get all of the token matches for the rules sorted by position."""
-        matches = self.get_matches(rules, text)
-        matches = [t for t in matches if t.valid_match()]
-        return self.sort_matches(matches)
+        return self.best_matches(rules, text, self.size)
 
     @staticmethod
     def remove_overlapping(matches: deque) -> deque:
@@ -142,8 +447,8 @@ class Parser:
     ) -> tuple[Token, int, int]:
         """Merge all matched tokens into one token."""
         # Get tokens in match
-        first_idx = match.start // SIZE
-        last_idx = match.end // SIZE
+        first_idx = match.start // self.size
+        last_idx = match.end // self.size
         span = (tokens[first_idx].start, tokens[last_idx - 1].end)
 
         # Merge all subgroups from sub-tokens into current token
@@ -154,9 +459,11 @@ class Parser:
 
         # Add groups from current token with real (not tokenized) text
         for key in match.match.capturesdict():
+            if key.startswith(DEFINED):
+                continue
             for i, value in enumerate(match.match.captures(key)):
-                idx1 = match.match.starts(key)[i] // SIZE
-                idx2 = match.match.ends(key)[i] // SIZE - 1
+                idx1 = match.match.starts(key)[i] // self.size
+                idx2 = match.match.ends(key)[i] // self.size - 1
                 self.append_group(
                     groups, key, text[tokens[idx1].start:tokens[idx2].end]
                 )
@@ -166,10 +473,64 @@ class Parser:
 
     def replace(self, tokens: Tokens, text: str) -> tuple[Tokens, bool]:
         """Replace token combinations with another token."""
-        replaced = []
-        token_text = ''.join([t.rule.token for t in tokens])
+        token_text = self.token_text(tokens)
         matches = self.match_tokens(self.replacers, token_text)
         again = bool(matches)
+        replaced, _ = self.replace_matches(matches, tokens, text)
+        return replaced, again
+
+    def replace_incremental(self, tokens: Tokens, text: str) -> Tokens:
+        """Replace token combinations until nothing changes.
+
+        The first round looks at all of the tokens. After that, a replacer can only
+        match near a token that was replaced in the previous round, so we only
+        rescan windows around those tokens.
+        """
+        windows = [(0, len(tokens))]
+        while windows:
+            token_text = self.token_text(tokens)
+            matches = self.match_windows(self.replacers, token_text, windows)
+            tokens, changed = self.replace_matches(matches, tokens, text)
+            windows = self.windows(changed, len(tokens))
+        return tokens
+
+    def windows(self, changed: list[int], count: int) -> list[tuple[int, int]]:
+        """Get the token windows around the changed tokens.
+
+        Windows that are close together are merged. If the windows cover most of
+        the tokens it is faster to rescan everything.
+        """
+        windows = []
+        for idx in changed:
+            lo = max(0, idx - self.replace_window)
+            hi = min(count, idx + self.replace_window + 1)
+            if windows and lo <= windows[-1][1] + self.replace_window:
+                windows[-1] = (windows[-1][0], hi)
+            else:
+                windows.append((lo, hi))
+
+        if sum(hi - lo for lo, hi in windows) > count // 2:
+            return [(0, count)]
+
+        return windows
+
+    def match_windows(
+            self, rules: Rules, text: str, windows: list[tuple[int, int]]
+    ) -> deque:
+        """Get the token matches for matches that start in the windows.
+
+        Replacers without a longest match are matched against all of the tokens.
+        """
+        spans = [(lo * self.size, hi * self.size) for lo, hi in windows]
+        spans = {r.name: spans for r in rules if r.name not in self.unbounded}
+        return self.best_matches(rules, text, self.size, spans)
+
+    def replace_matches(
+            self, matches: deque, tokens: Tokens, text: str
+    ) -> tuple[Tokens, list[int]]:
+        """Replace the matched tokens and return where the new tokens are."""
+        replaced = []
+        changed = []
 
         prev_idx = 0
         while matches:
@@ -179,10 +540,57 @@ class Parser:
                 token.action(token)
             if prev_idx != first_idx:
                 replaced += tokens[prev_idx:first_idx]
+            changed.append(len(replaced))
             replaced.append(token)
             prev_idx = last_idx
 
         if prev_idx != len(tokens):
             replaced += tokens[prev_idx:]
 
-        return replaced, again
+        return replaced, changed
+
+
+# The parser in a worker process
+WORKER_PARSER: Optional[Parser] = None
+
+
+def init_worker(factory: Optional[Callable[[], Parser]]) -> None:
+    """Build the parser once per worker process."""
+    global WORKER_PARSER  # pylint: disable=global-statement
+    if factory:
+        WORKER_PARSER = factory()
+    WORKER_PARSER.build()
+
+
+def parse_chunk(texts: list[str]) -> list[Packed]:
+    """Parse texts in a worker and pack the tokens so they can be pickled."""
+    return [[(t.name, t.span, t.group) for t in WORKER_PARSER.parse(text)]
+            for text in texts]
+
+
+def unpack(rules: RuleDict, chunk: list[Packed]) -> Iterator[Tokens]:
+    """Convert packed tokens from a worker back into tokens.
+
+    The worker's parser may have been built with its rules in another order so we
+    find the rules by name.
+    """
+    for packed in chunk:
+        tokens = []
+        for name, span, group in packed:
+            if (rule := rules.get(name)) is None:
+                raise ValueError(f'The worker parser has a rule "{name}" that '
+                                 f'this parser does not')
+            tokens.append(Token(rule, span=span, group=group))
+        yield tokens
+
+
+def boundary(text: str, pos: int, low: int) -> int:
+    """Find a place to split the text before pos and after low.
+
+    Prefer a line break, then a space. Otherwise split at pos.
+    """
+    for char in '\n ':
+        idx = text.rfind(char, low, pos)
+        if idx >= 0:
+            return idx + 1
+    return pos
@@ -0,0 +1,213 @@
+"""Skip scanner rules that cannot match a text.
+
+Most scanner rules can only match if the text contains some literal, like a unit
+word, a digit, or a month name. When the parser is built we extract these
+requirements from each rule's pattern. A requirement is a list of clauses, every
+clause must be satisfied, and a clause is satisfied if any one of its needles is in
+the text. A needle is either a literal string or a character class.
+
+For each text we casefold it once and then check each distinct needle once. Only
+the rules with all of their clauses satisfied are run.
+
+We use Python's own regex parser to read the patterns. It does not understand all
+of the regex module's syntax, so a rule we cannot parse is always run. Some regex
+module syntax, like fuzzy matching "{e<=1}" or POSIX classes "[[:digit:]]", is read
+as literals by Python's parser instead of failing. We look for it before parsing
+and we treat the parser's warnings about nested sets and set operations as failures.
+Missing a requirement only costs time, it never drops a match.
+"""
+
+import warnings
+from collections import defaultdict
+from typing import Optional
+
+import regex
+
+from traiter.const import FLAGS
+from .rule import Rules
+
+try:
+    import re._parser as sre_parse  # pylint: disable=ungrouped-imports
+except ImportError:  # Python < 3.11
+    import sre_parse  # pylint: disable=deprecated-module
+
+# A needle is ('str', casefolded literal) or ('re', character class regex)
+Needle = tuple[str, str]
+Clause = frozenset[Needle]
+Requirement = list[Clause]
+
+STR = 'str'
+RE = 're'
+
+# Only enumerate character ranges up to this size
+MAX_RANGE = 256
+
+CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: r'\d',
+    sre_parse.CATEGORY_WORD: r'\w',
+    sre_parse.CATEGORY_SPACE: r'\s',
+}
+
+# Regex module syntax that Python's parser misreads: fuzzy constraints like
+# "{e<=1}" or "{2i+1d<3}", POSIX classes, and version 1 patterns with set operations
+REGEX_ONLY = regex.compile(
+    r""" \{ [^{}]* [eisd] [^{}]* \} | \[\[: | \(\?[a-z]*V1 """, regex.VERBOSE)
+
+NAMED_GROUP = regex.compile(r'\(\?P<\w+>')
+
+REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT}
+REPEATS |= {getattr(sre_parse, 'POSSESSIVE_REPEAT', sre_parse.MAX_REPEAT)}
+
+
+class Prefilter:
+    """Find the scanner rules that could match a text."""
+
+    def __init__(self, rules: Rules) -> None:
+        self.rules = rules
+
+        clause_ids: dict[Clause, int] = {}
+        self.rule_clauses: list[frozenset[int]] = []
+        for rule in rules:
+            clauses = requirement(rule.regexp.pattern)
+            ids = frozenset(clause_ids.setdefault(c, len(clause_ids)) for c in clauses)
+            self.rule_clauses.append(ids)
+
+        # Rules that we could not find any requirement for are always run
+        self.always = [i for i, ids in enumerate(self.rule_clauses) if not ids]
+
+        self.clause_rules = defaultdict(list)
+        for i, ids in enumerate(self.rule_clauses):
+            for clause_id in ids:
+                self.clause_rules[clause_id].append(i)
+
+        self.needle_clauses = defaultdict(list)
+        for clause, clause_id in clause_ids.items():
+            for needle in clause:
+                self.needle_clauses[needle].append(clause_id)
+
+        self.strings = [n[1] for n in self.needle_clauses if n[0] == STR]
+        self.classes = [
+            (n, regex.compile(n[1], FLAGS)) for n in self.needle_clauses if n[0] == RE]
+
+    def filter(self, text: str) -> Rules:
+        """Get the rules that could match the text, in their original order."""
+        folded = text.casefold()
+        found = [(STR, s) for s in self.strings if s in folded]
+        found += [n for n, class_ in self.classes if class_.search(text)]
+
+        satisfied = set()
+        for needle in found:
+            satisfied.update(self.needle_clauses[needle])
+
+        candidates = set(self.always)
+        for clause_id in satisfied:
+            candidates.update(self.clause_rules[clause_id])
+
+        return [
+            self.rules[i] for i in sorted(candidates)
+            if satisfied.issuperset(self.rule_clauses[i])
+        ]
+
+
+def requirement(pattern: str) -> Requirement:
+    """Get the clauses that a text must satisfy for the pattern to match."""
+    parsed = parse(pattern)
+    return [] if parsed is None else sequence(list(parsed))
+
+
+def max_width(pattern: str) -> Optional[int]:
+    """Get the most characters the pattern can match.
+
+    Returns None if there is no limit or if we cannot tell.
+    """
+    # Rules often repeat a group name which Python's parser does not allow
+    parsed = parse(NAMED_GROUP.sub('(?:', pattern))
+    if parsed is None:
+        return None
+    _, high = parsed.getwidth()
+    return None if high >= sre_parse.MAXREPEAT else high
+
+
+def parse(pattern: str):
+    """Parse the pattern with Python's regex parser, None if we cannot."""
+    if REGEX_ONLY.search(pattern):
+        return None
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', FutureWarning)  # Possible nested set etc.
+            return sre_parse.parse(pattern, int(FLAGS))
+    except (sre_parse.error, FutureWarning, TypeError, ValueError, OverflowError,
+            RecursionError):
+        return None
+
+
+def sequence(items: list) -> Requirement:
+    """Every item in a sequence must match."""
+    clauses = []
+    literal = []
+    for op, arg in items + [(None, None)]:
+        if op == sre_parse.LITERAL:
+            literal.append(chr(arg))
+            continue
+        if literal:
+            clauses.append(frozenset([(STR, ''.join(literal).casefold())]))
+            literal = []
+        if op is not None:
+            clauses += item(op, arg)
+    return clauses
+
+
+def item(op, arg) -> Requirement:
+    """Get the requirement for one parsed regex item."""
+    if op == sre_parse.IN:
+        needles = char_class(arg)
+        return [needles] if needles else []
+
+    if op == sre_parse.SUBPATTERN:
+        return sequence(list(arg[-1]))
+
+    if op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+        return sequence(list(arg))
+
+    if op in REPEATS:
+        low, _, sub = arg
+        return sequence(list(sub)) if low > 0 else []
+
+    if op == sre_parse.BRANCH:
+        clause = set()
+        for branch in arg[1]:
+            best = choose(sequence(list(branch)))
+            if not best:
+                return []
+            clause |= best
+        return [frozenset(clause)]
+
+    # Anchors, lookarounds, back references, "." etc. add no requirements
+    return []
+
+
+def char_class(items: list) -> Optional[Clause]:
+    """Get the needles for a character class like [a-z\\d]."""
+    needles = set()
+    for op, arg in items:
+        if op == sre_parse.LITERAL:
+            needles.add((STR, chr(arg).casefold()))
+        elif op == sre_parse.RANGE and arg[1] - arg[0] < MAX_RANGE:
+            needles |= {(STR, chr(c).casefold()) for c in range(arg[0], arg[1] + 1)}
+        elif op == sre_parse.CATEGORY and arg in CATEGORIES:
+            needles.add((RE, CATEGORIES[arg]))
+        else:
+            return None
+    return frozenset(needles) if needles else None
+
+
+def choose(clauses: Requirement) -> Optional[Clause]:
+    """Pick the clause that is least likely to be satisfied by chance."""
+    if not clauses:
+        return None
+    return max(clauses, key=lambda c: (min(length(n) for n in c), -len(c)))
+
+
+def length(needle: Needle) -> int:
+    """How many characters the needle matches."""
+    return len(needle[1]) if needle[0] == STR else 1
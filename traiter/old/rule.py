@@ -1,8 +1,9 @@
 """RuleList for parsing and rule builders."""
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import IntEnum
-from typing import Any, Callable, Pattern, Union
+from functools import lru_cache
+from typing import Any, Callable, Optional, Pattern, Union
 
 import regex
 
@@ -11,6 +12,25 @@ from traiter.const import FLAGS
 TOKEN = 0
 SIZE = 4
 
+# How rule tokens are written in the strings that groupers etc. match against
+HEX = 'hex'  # Each token is SIZE hex digits
+CHAR = 'char'  # Each token is a single private use character
+ENCODINGS = {HEX: SIZE, CHAR: 1}  # The size of a token in each encoding
+
+# How referenced groupers are written into a rule's regex
+INLINE = 'inline'  # Paste in a copy of the grouper's expanded regex every time
+SHARED = 'shared'  # Define each grouper once and call it as a subroutine
+EXPANSIONS = (INLINE, SHARED)
+
+# Group names for the shared grouper definitions start with this
+DEFINED = 'defined__'
+
+# How many compiled rule regexes to keep for all parsers in the process
+COMPILE_CACHE_SIZE = 4096
+
+# Private use areas: The BMP area and then supplementary area A
+PRIVATE_USE = ((0xE000, 0xF8FF), (0xF0000, 0xFFFFD))
+
 # Find tokens in the regex. Look for words that are not part of a group
 # name or a metacharacter. So, "word" not "<word>". Neither "(?P" nor "\b".
 WORD = regex.compile(
@@ -52,6 +72,10 @@ class Rule:  # pylint: disable=too-many-instance-attributes
     regexp: Pattern = None  # The compiled regexp
     capture: bool = True  # Will the rule create an outer capture group?
     priority: int = 0  # When should the rule be triggered: FIRST? LAST?
+    char: str = field(init=False, repr=False)  # The token in the CHAR encoding
+
+    def __post_init__(self):
+        self.char = to_char(self.token)
 
     def __lt__(self, other: 'Rule'):
         """Custom sort order."""
@@ -64,8 +88,26 @@ class Rule:  # pylint: disable=too-many-instance-attributes
         me_ = tuple(v for k, v in self.__dict__.items() if k in fields)
         return me_ == you
 
-    def build(self, rules: RuleDict) -> str:
-        """Build regular expressions for token matches."""
+    def code(self, encoding: str = HEX) -> str:
+        """Get the rule's token in the given encoding."""
+        return self.char if encoding == CHAR else self.token
+
+    def words(self) -> list[str]:
+        """Get the names of the rules used in the pattern."""
+        return WORD.findall(self.pattern)
+
+    def expand(
+            self,
+            rules: RuleDict,
+            encoding: str = HEX,
+            expansion: str = INLINE,
+            patterns: Optional[dict[str, str]] = None,
+    ) -> str:
+        """Replace the rule names in the pattern with what they match.
+
+        The patterns are already built regexes for the inline expansion. Rules
+        not in it use the regex they were last compiled with.
+        """
 
         def _rep(match):
             word = match.group('word')
@@ -74,7 +116,13 @@ class Rule:  # pylint: disable=too-many-instance-attributes
             sub = rules.get(word)
 
             if sub.type == RuleType.SCANNER:
-                return fr'(?: {sub.token} )'
+                return fr'(?: {sub.code(encoding)} )'
+
+            if expansion == SHARED:
+                return fr'(?&{DEFINED}{sub.name})'
+
+            if patterns and word in patterns:
+                return patterns[word]
 
             return sub.regexp.pattern
 
@@ -84,10 +132,79 @@ class Rule:  # pylint: disable=too-many-instance-attributes
             return fr'(?P<{self.name}> {regexp} )'
         return fr'(?: {regexp} )'
 
-    def compile(self, rules: RuleDict):
+    def build(
+            self,
+            rules: RuleDict,
+            encoding: str = HEX,
+            expansion: str = INLINE,
+            patterns: Optional[dict[str, str]] = None,
+    ) -> str:
+        """Build regular expressions for token matches.
+
+        With the shared expansion every grouper the rule uses is written once in a
+        DEFINE block and then called by name. So the regex grows with the number of
+        groupers used and not with how deeply they nest.
+        """
+        regexp = self.expand(rules, encoding, expansion, patterns)
+
+        if expansion == SHARED:
+            defines = [
+                f'(?P<{DEFINED}{s.name}> {s.expand(rules, encoding, SHARED)} )'
+                for s in closure(self.words(), rules)
+                if s.type != RuleType.SCANNER
+            ]
+            if defines:
+                regexp = f'(?(DEFINE) {" ".join(defines)} ) {regexp}'
+
+        return regexp
+
+    def compile(
+            self, rules: RuleDict, encoding: str = HEX, expansion: str = INLINE
+    ) -> None:
         """Build and compile a rule."""
-        pattern = self.build(rules)
-        self.regexp = regex.compile(pattern, FLAGS)
+        pattern = self.build(rules, encoding, expansion)
+        self.regexp = compile_pattern(pattern)
+
+
+def closure(names: list[str], rules: RuleDict) -> Rules:
+    """Get the named rules and all of the rules they use, each one once."""
+    found = {}
+    stack = list(reversed(names))
+    while stack:
+        name = stack.pop()
+        if name in found or name not in rules:
+            continue
+        found[name] = rules[name]
+        stack += reversed(rules[name].words())
+    return list(found.values())
+
+
+def dependencies(names: list[str], rules: RuleDict) -> Rules:
+    """Get the named rules and all of the rules they use.
+
+    Each rule is listed once and after all of the rules it uses.
+    """
+    found, seen = [], set()
+    stack = [(n, False) for n in reversed(names)]
+    while stack:
+        name, done = stack.pop()
+        if done:
+            found.append(rules[name])
+        elif name not in seen and name in rules:
+            seen.add(name)
+            stack.append((name, True))
+            stack += [(w, False) for w in reversed(rules[name].words())]
+    return found
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def compile_pattern(pattern: str) -> Pattern:
+    """Compile a built rule regex.
+
+    Built regexes contain the tokens of the rules they use so equal regexes mean
+    equal rules. Parsers that share rules share the compiled regexes.
+    """
+    return regex.compile(pattern, FLAGS)
 
 
 def next_token() -> str:
@@ -97,6 +214,16 @@ def next_token() -> str:
     return f'{TOKEN:04x}'
 
 
+def to_char(token: str) -> str:
+    """Convert a hex token into a single private use character."""
+    code = int(token, 16)
+    for first, last in PRIVATE_USE:
+        if code <= last - first:
+            return chr(first + code)
+        code -= last - first + 1
+    raise ValueError(f'Too many tokens to convert "{token}" to a character')
+
+
 def join(regexp: InRegexp) -> str:
     """Build a single regexp from multiple strings."""
     if isinstance(regexp, (list, tuple, set)):
@@ -0,0 +1,168 @@
+"""Find the matches of many term rules with one pass over the text.
+
+A term rule is a regex wrapped in word boundaries, like "\\b (?: red | dark red ) \\b".
+Most vocabulary terms are lists of words like this. So each match of one of these
+rules starts at the start of a run of word characters, and if the term's words are
+literals then that first run must be one of the term's first words.
+
+When the parser is built we read the first words of each term rule. Then for each
+text we find the runs of word characters once and look up the rules whose terms
+could start with each run. Only those rules are matched there, anchored at the start
+of the run. Each rule only matches after the end of its previous match, so the
+results are the same as running finditer for each rule.
+
+Rules that we cannot read this way, like ones that start with a word character
+class like [a-z]+ or with a word we cannot case fold simply, are still run one at a
+time.
+"""
+
+from collections import defaultdict
+from typing import Optional
+
+import regex
+
+from traiter.const import FLAGS
+from .prefilter import parse, sre_parse
+from .rule import Rule, RuleType, Rules
+
+# How many first words we read from one rule before giving up on it
+MAX_HEADS = 1_000
+
+WORDS = regex.compile(r'\w+', FLAGS)
+WORD_CHAR = regex.compile(r'\w', FLAGS)
+
+# Casefolding a word gets the ASCII letters the regex module matches it to, except
+# for the Turkish i's
+TURKISH = str.maketrans('İı', 'ii')
+
+# Items in a pattern that only match characters that are not word characters
+NOT_WORD = {sre_parse.CATEGORY_SPACE, sre_parse.CATEGORY_NOT_WORD}
+
+Matches = dict[str, list]  # Rule name to its regex matches
+
+
+class TermIndex:
+    """Find the matches of the term rules that start with literal words."""
+
+    def __init__(self, rules: Rules) -> None:
+        self.rules: Rules = []
+        self.heads: dict[str, list[int]] = defaultdict(list)
+        for rule in rules:
+            if (words := term_heads(rule)) is not None:
+                for word in words:
+                    self.heads[word].append(len(self.rules))
+                self.rules.append(rule)
+        self.names = {r.name for r in self.rules}
+
+    def find(self, text: str) -> Matches:
+        """Get the matches of the rules in the text, the same as their finditer.
+
+        Only rules with matches are returned, in the order of the rules.
+        """
+        found = defaultdict(list)
+        ends = [0] * len(self.rules)
+        for word in WORDS.finditer(text):
+            chars = word.group()
+            if chars.isascii():
+                key = chars.lower()
+            else:
+                key = chars.translate(TURKISH).casefold()
+            if (ids := self.heads.get(key)) is None:
+                continue
+            start = word.start()
+            for i in ids:
+                if start < ends[i]:
+                    continue
+                rule = self.rules[i]
+                if match := rule.regexp.match(text, start):
+                    found[i].append(match)
+                    ends[i] = match.end()
+        return {self.rules[i].name: found[i] for i in sorted(found)}
+
+
+def term_heads(rule: Rule) -> Optional[set[str]]:
+    """Get the first words of the term rule, None if it is not a term or unknown."""
+    if rule.type != RuleType.SCANNER or rule.regexp is None:
+        return None
+    wrapped = (
+        fr'\b (?P<{rule.name}> {rule.pattern} ) \b',
+        fr'\b (?: {rule.pattern} ) \b',
+    )
+    if rule.regexp.pattern not in wrapped or rule.regexp.flags & FLAGS != FLAGS:
+        return None
+    parsed = parse(rule.pattern)
+    return None if parsed is None else heads(list(parsed), {''})
+
+
+def heads(items: list, prefixes: set[str]) -> Optional[set[str]]:
+    """Get the words the items can start with after the given word prefixes.
+
+    Returns None if we cannot tell where the first word ends.
+    """
+    for i, (op, arg) in enumerate(items):
+        if op == sre_parse.LITERAL:
+            chars = [chr(arg)]
+        elif op == sre_parse.IN:
+            chars = [chr(a) for o, a in arg if o == sre_parse.LITERAL]
+            if len(chars) != len(arg):
+                categories = {a for o, a in arg if o == sre_parse.CATEGORY}
+                if len(chars) + len(categories) != len(arg) or categories - NOT_WORD:
+                    return None
+                chars.append(' ')  # Any character that is not a word character
+        elif op == sre_parse.SUBPATTERN:
+            if arg[1] or arg[2]:  # Flags added or removed in the group
+                return None
+            return heads(list(arg[3]) + items[i + 1:], prefixes)
+        elif op == sre_parse.BRANCH:
+            words = set()
+            for branch in arg[1]:
+                found = heads(list(branch) + items[i + 1:], prefixes)
+                if found is None:
+                    return None
+                words |= found
+            return words
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, high, sub = arg
+            if high == 1:  # An optional item like "males?"
+                return optional(list(sub), low, items[i + 1:], prefixes)
+            if low < 1 or ends_word(list(sub)) is not True:
+                return None
+            return done(prefixes)
+        else:
+            return None
+
+        words = [c for c in chars if WORD_CHAR.fullmatch(c)]
+        if not all(c.isascii() for c in words):  # Case folding is not simple
+            return None
+        if len(words) == len(chars):
+            prefixes = {p + c.lower() for p in prefixes for c in words}
+            if len(prefixes) > MAX_HEADS:
+                return None
+        elif words:  # Some characters continue the word and some end it
+            return None
+        else:
+            return done(prefixes)
+
+    return done(prefixes)
+
+
+def optional(
+        sub: list, low: int, rest: list, prefixes: set[str]
+) -> Optional[set[str]]:
+    """Get the first words with and, if it may be skipped, without the item."""
+    words = heads(sub + rest, prefixes)
+    if words is not None and low == 0:
+        skipped = heads(rest, prefixes)
+        words = None if skipped is None else words | skipped
+    return None if words is None or len(words) > MAX_HEADS else words
+
+
+def ends_word(items: list) -> Optional[bool]:
+    """Check if the first item can only match a character that ends a word."""
+    found = heads(items[:1], {'x'})
+    return None if found is None else found == {'x'}
+
+
+def done(prefixes: set[str]) -> Optional[set[str]]:
+    """The first word ends here, it must have at least one character."""
+    return None if '' in prefixes else prefixes
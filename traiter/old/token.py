@@ -1,12 +1,26 @@
 """A class to hold an individual token."""
 
-from traiter.old.rule import Action, Groups, Rule, SIZE
+from array import array
+from typing import Any, Callable, Iterator, Optional
+
+from traiter.old.rule import Action, Groups, Rule, Rules, SIZE
 
 Tokens = list['Token']
+Rematch = Callable[[Rule, str, int], Any]  # Get a rule's regex match at a position
+Window = tuple[int, int]
 
 
 class Token:
-    """A token is the result of a rule match."""
+    """A token is the result of a rule match.
+
+    The groups of a token built from a match are only extracted from the match when
+    they are used. Most scanner tokens are thrown away before that. A lazy token
+    from a TokenStream does not even have its match until it is used. It matches
+    its rule again at the same position in the text. The span may be moved, e.g.
+    by Parser.parse_stream, without changing where the rule is matched.
+    """
+
+    __slots__ = ('rule', '_match', 'span', '_group', '_text', '_pos', '_rematch')
 
     def __init__(
             self,
@@ -14,16 +28,47 @@ class Token:
             match=None,  # A regex match (not re)
             group: Groups = None,
             span: tuple[int, int] = None,
+            text: Optional[str] = None,  # Match the rule in here when needed
+            rematch: Optional[Rematch] = None,
     ) -> None:
         """Create a token."""
         self.rule = rule
-        self.match = match
+        self._match = match
         self.span = span if span else (0, 0)
-        self.group = group if group else {}
+        self._group = group if group else {}
+        self._text = text
+        self._pos = self.span[0]  # Where to match the rule in the text
+        self._rematch = rematch
 
         if match:
             self.span = match.span()
-            self.group = {k: v for k, v in match.groupdict().items() if v is not None}
+            self._group = None
+        elif rematch:
+            self._group = None
+
+    @property
+    def match(self):
+        """Get the regex match, matching the rule again if the token is lazy."""
+        if self._match is None and self._rematch is not None:
+            self._match = self._rematch(self.rule, self._text, self._pos)
+            self._text = self._rematch = None
+        return self._match
+
+    @match.setter
+    def match(self, match) -> None:
+        self._match = match
+
+    @property
+    def group(self) -> Groups:
+        """Get the named groups of the match."""
+        if self._group is None:
+            groups = self.match.groupdict().items()
+            self._group = {k: v for k, v in groups if v is not None}
+        return self._group
+
+    @group.setter
+    def group(self, group: Groups) -> None:
+        self._group = group
 
     def __repr__(self) -> str:
         """Create string form of the object."""
@@ -61,3 +106,78 @@ class Token:
     def valid_match(self) -> bool:
         """Make sure a token match is valid."""
         return self.span[0] % SIZE == 0
+
+
+class TokenStream:
+    """Hold many rule matches in typed arrays.
+
+    The parser throws many matches away because they overlap better ones. So we only
+    hold the rule index and span of each match and not its regex match object. The
+    tokens for the matches we keep match their rules again at the same spots, but
+    only when their groups or matches are used.
+
+    This saves memory on long texts but it is slower than keeping the matches,
+    because most matches are kept and then matched twice. The parser only uses it
+    with lazy_matches=True.
+    """
+
+    __slots__ = ('rules', 'rule_ids', 'starts', 'ends')
+
+    def __init__(self, rules: Rules) -> None:
+        self.rules = rules
+        self.rule_ids = array('i')
+        self.starts = array('q')
+        self.ends = array('q')
+
+    def __len__(self) -> int:
+        return len(self.rule_ids)
+
+    def append(self, rule_id: int, start: int, end: int) -> None:
+        """Add a match for the rule at the given index."""
+        self.rule_ids.append(rule_id)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def scan(
+            self,
+            rule_id: int,
+            matches: Iterator,
+            size: Optional[int] = None,
+            stop: Optional[int] = None,
+    ) -> None:
+        """Add the matches for the rule at the given index.
+
+        If given a size then only keep matches that start on a token boundary. If
+        given a stop then only keep matches that start before it.
+        """
+        for match in matches:
+            start, end = match.span()
+            if stop is not None and start >= stop:
+                break
+            if size is None or start % size == 0:
+                self.append(rule_id, start, end)
+
+    def best(self, text: str, rematch: Rematch) -> Tokens:
+        """Get tokens for the best non-overlapping matches.
+
+        Matches are ordered the same way as Parser.sort_matches: by start, then
+        by rule priority, then longest first. Then we drop the matches that overlap
+        a previous one.
+        """
+        priorities = [r.priority for r in self.rules]
+        keys = sorted(zip(
+            self.starts,
+            [priorities[i] for i in self.rule_ids],
+            [-e for e in self.ends],
+            self.rule_ids))
+
+        tokens = []
+        end = 0
+        for start, _, neg_end, rule_id in keys:
+            if start < end:
+                continue
+            span = (start, -neg_end)
+            tokens.append(Token(
+                self.rules[rule_id], span=span, text=text, rematch=rematch))
+            end = -neg_end
+        return tokens
@@ -0,0 +1,347 @@
+"""Hold the entity data for a whole doc as columns.
+
+Entity data pipes write into ent._.data and token._.data. With a dict per entity and
+per token most of a batch's memory goes to these dicts. Here a doc keeps all of its
+entity data in one store with a sparse column per field. A span or token gets a
+row, and a column only holds the rows that set its field. String values are kept in
+a string table so repeated values like "female" are stored once.
+
+The _.data extensions are views into the store, so they still act like dicts. Use
+dict(ent._.data) to get a real one, for instance for json.dumps. Like spaCy's own
+extension data, rows are keyed by character offsets. So a new span with the same
+offsets as an old one, like a relabeled entity, sees the same data.
+
+The new_label and cached_label extensions are kept the same way, in a second store.
+
+The stores are kept in doc.user_data. They are written as typed columns so that
+Doc.to_bytes, DocBin, and spaCy's multiprocess pipe move them cheaply.
+"""
+
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import MutableMapping
+from typing import Any, Iterator, Optional, Union
+
+import srsly
+from spacy.tokens import Doc, Span, Token
+
+DATA = 'traiter_data'  # The key for the data store in doc.user_data
+LABELS = 'traiter_labels'  # The key for the label store in doc.user_data
+MARKER = '__data_store__'  # Marks a serialized data store
+
+SPAN = 0
+TOKEN = 1
+
+# Column types
+STR = 's'
+INT = 'i'
+FLOAT = 'f'
+OBJ = 'o'
+TYPECODES = {STR: 'i', INT: 'q', FLOAT: 'd'}  # Array types for the simple columns
+
+ROWS = ('b', 'i', 'i')  # Array types for the row key columns
+
+INT_MIN = -(2 ** 63)
+INT_MAX = 2 ** 63 - 1
+
+RowKey = tuple[int, int, int]  # (SPAN or TOKEN, start char, end char)
+
+
+class Missing:
+    """A column value for rows that do not have the field."""
+
+    def __repr__(self) -> str:
+        return 'MISSING'
+
+    def __reduce__(self) -> str:
+        return 'MISSING'  # Unpickle to the same object so "is MISSING" still works
+
+
+MISSING = Missing()
+
+
+class Column:
+    """One field's values for the rows that have it.
+
+    The row numbers are kept sorted in an array. The values are in a typed array
+    when they all have one simple type, strings are stored as IDs into the store's
+    string table. Otherwise they are in a list.
+    """
+
+    __slots__ = ('rows', 'type', 'values')
+
+    def __init__(self, type_: str) -> None:
+        self.rows = array('i')
+        self.type = type_
+        self.values = array(TYPECODES[type_]) if type_ in TYPECODES else []
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def find(self, row: int) -> int:
+        """Get where the row is in the column or -1 if it does not have the field."""
+        idx = bisect_left(self.rows, row)
+        return idx if idx < len(self.rows) and self.rows[idx] == row else -1
+
+    def set(self, row: int, value: Any) -> None:
+        """Set a row's value, it must already be encoded for the column's type."""
+        if not self.rows or self.rows[-1] < row:  # Rows are usually added in order
+            self.rows.append(row)
+            self.values.append(value)
+        elif (idx := self.find(row)) >= 0:
+            self.values[idx] = value
+        else:
+            idx = bisect_left(self.rows, row)
+            self.rows.insert(idx, row)
+            self.values.insert(idx, value)
+
+    def remove(self, row: int) -> None:
+        """Remove a row's value if it has one."""
+        if (idx := self.find(row)) >= 0:
+            del self.rows[idx]
+            del self.values[idx]
+
+
+class DataStore:
+    """All of the entity data in a doc.
+
+    Each field is a sparse column so memory grows with the values that are set and
+    not with the number of rows times the number of fields.
+    """
+
+    def __init__(self) -> None:
+        self.rows: dict[int, int] = {}  # Packed row keys to row numbers
+        self.columns: dict[str, Column] = {}
+        self.strings: list[str] = []
+        self.string_ids: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def row(self, key: RowKey, add: bool = False) -> Optional[int]:
+        """Get the row number for the key, optionally adding a new row."""
+        packed = pack_key(key)
+        row = self.rows.get(packed)
+        if row is None and add:
+            row = self.rows[packed] = len(self.rows)
+        return row
+
+    def get(self, row: int, field: str) -> Any:
+        """Get a field's value for a row, MISSING if it is not set."""
+        column = self.columns.get(field)
+        if column is None or (idx := column.find(row)) < 0:
+            return MISSING
+        value = column.values[idx]
+        return self.strings[value] if column.type == STR else value
+
+    def set(self, row: int, field: str, value: Any) -> None:
+        """Set a field's value for a row. Setting it to MISSING removes it."""
+        column = self.columns.get(field)
+        if value is MISSING:
+            if column is not None:
+                column.remove(row)
+                if not column:
+                    del self.columns[field]
+            return
+
+        type_ = value_type(value)
+        if column is None:
+            column = self.columns[sys.intern(field)] = Column(type_)
+        elif type_ != column.type and column.type != OBJ:
+            self.to_objects(column)
+
+        if column.type == STR:
+            value = self.string_id(value)
+        column.set(row, value)
+
+    def string_id(self, value: str) -> int:
+        """Get the ID of a string in the string table, adding it if needed."""
+        if (id_ := self.string_ids.get(value)) is None:
+            id_ = self.string_ids[value] = len(self.strings)
+            self.strings.append(sys.intern(value))
+        return id_
+
+    def to_objects(self, column: Column) -> None:
+        """Change a column to hold values of any type."""
+        values = column.values
+        if column.type == STR:
+            values = [self.strings[v] for v in values]
+        column.values = list(values)
+        column.type = OBJ
+
+    def fields(self, row: int) -> list[str]:
+        """Get the fields that are set for a row."""
+        return [f for f, c in self.columns.items() if c.find(row) >= 0]
+
+    def to_dict(self) -> dict:
+        """Convert the store to something msgpack can write.
+
+        Each column is written as an array of the rows that have the field and an
+        array of the values, if the values all have one simple type.
+        """
+        columns = []
+        for column in self.columns.values():
+            if column.type == OBJ:
+                values = srsly.msgpack_dumps(column.values)
+            else:
+                values = column.values.tobytes()
+            columns.append((column.rows.tobytes(), column.type, values))
+
+        keys = [unpack_key(k) for k in self.rows]  # Rows are in the order added
+        return {
+            MARKER: list(self.columns),
+            'rows': tuple(
+                array(c, [k[i] for k in keys]).tobytes() for i, c in enumerate(ROWS)),
+            'columns': columns,
+            'strings': self.strings,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'DataStore':
+        """Rebuild a store from to_dict() output."""
+        store = cls()
+        store.strings = [sys.intern(s) for s in data['strings']]
+        store.string_ids = {s: i for i, s in enumerate(store.strings)}
+        kinds, starts, ends = (to_array(c, b) for c, b in zip(ROWS, data['rows']))
+        store.rows = {
+            pack_key(k): i for i, k in enumerate(zip(kinds, starts, ends))}
+        for field, (rows, type_, values) in zip(data[MARKER], data['columns']):
+            column = store.columns[sys.intern(field)] = Column(type_)
+            column.rows = to_array('i', rows)
+            if type_ == OBJ:
+                column.values = srsly.msgpack_loads(values, use_list=True)
+            else:
+                column.values = to_array(TYPECODES[type_], values)
+        return store
+
+    def __reduce__(self) -> tuple:
+        return self.from_dict, (self.to_dict(),)
+
+
+def pack_key(key: RowKey) -> int:
+    """Pack a row key into one int, it takes less memory than a tuple."""
+    kind, start, end = key
+    return (start << 32 | end) << 1 | kind
+
+
+def unpack_key(packed: int) -> RowKey:
+    """Get the row key back from pack_key()."""
+    return packed & 1, packed >> 33, (packed >> 1) & 0xFFFFFFFF
+
+
+def value_type(value: Any) -> str:
+    """Get the column type for a value."""
+    if type(value) is str:  # pylint: disable=unidiomatic-typecheck
+        return STR
+    if type(value) is int and INT_MIN <= value <= INT_MAX:  # No bools
+        return INT
+    if type(value) is float:  # pylint: disable=unidiomatic-typecheck
+        return FLOAT
+    return OBJ
+
+
+def to_array(typecode: str, data: bytes) -> array:
+    """Rebuild an array from its bytes."""
+    values = array(typecode)
+    values.frombytes(data)
+    return values
+
+
+class DataView(MutableMapping):
+    """A dict like view of one span's or token's data in the store.
+
+    A view is not a dict, so json.dumps(ent._.data) fails. Use dict(ent._.data) or
+    ent._.data.copy() to get a plain dict to serialize or keep after the doc.
+    """
+
+    def __init__(self, store: DataStore, key: RowKey) -> None:
+        self.store = store
+        self.key = key
+
+    def __getitem__(self, field: str) -> Any:
+        row = self.store.row(self.key)
+        value = MISSING if row is None else self.store.get(row, field)
+        if value is MISSING:
+            raise KeyError(field)
+        return value
+
+    def __setitem__(self, field: str, value: Any) -> None:
+        self.store.set(self.store.row(self.key, add=True), field, value)
+
+    def __delitem__(self, field: str) -> None:
+        self[field]  # pylint: disable=pointless-statement
+        self.store.set(self.store.row(self.key), field, MISSING)
+
+    def __iter__(self) -> Iterator[str]:
+        row = self.store.row(self.key)
+        return iter([] if row is None else self.store.fields(row))
+
+    def __len__(self) -> int:
+        row = self.store.row(self.key)
+        return 0 if row is None else len(self.store.fields(row))
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    def copy(self) -> dict:
+        """Get the data as a plain dict, like dict.copy()."""
+        return dict(self)
+
+
+def get_store(doc: Doc, key: str = DATA) -> DataStore:
+    """Get one of the doc's stores, adding an empty one if needed."""
+    if (store := doc.user_data.get(key)) is None:
+        store = doc.user_data[key] = DataStore()
+    return store
+
+
+def row_key(obj: Union[Span, Token]) -> RowKey:
+    """Get the store row key for a span or token."""
+    if isinstance(obj, Token):
+        return TOKEN, obj.idx, obj.idx + len(obj)
+    return SPAN, obj.start_char, obj.end_char
+
+
+def get_data(obj: Union[Span, Token]) -> DataView:
+    """Get the _.data view for a span or token."""
+    return DataView(get_store(obj.doc), row_key(obj))
+
+
+def set_data(obj: Union[Span, Token], data: dict) -> None:
+    """Replace all of a span's or token's data."""
+    data = dict(data)  # The data may be a view of this same row
+    view = get_data(obj)
+    view.clear()
+    view.update(data)
+
+
+def get_label(obj: Union[Span, Token], field: str) -> str:
+    """Get a label extension like _.new_label for a span or token."""
+    if (store := obj.doc.user_data.get(LABELS)) is None:
+        return ''
+    row = store.row(row_key(obj))
+    value = MISSING if row is None else store.get(row, field)
+    return '' if value is MISSING else value
+
+
+def set_label(obj: Union[Span, Token], value: str, field: str) -> None:
+    """Set a label extension like _.new_label for a span or token."""
+    store = get_store(obj.doc, LABELS)
+    store.set(store.row(row_key(obj), add=True), field, value)
+
+
+@srsly.msgpack_encoders(DATA)
+def encode_data(obj, chain=None):
+    """Let Doc.to_bytes write data stores."""
+    if isinstance(obj, DataStore):
+        return obj.to_dict()
+    return obj if chain is None else chain(obj)
+
+
+@srsly.msgpack_decoders(DATA)
+def decode_data(obj, chain=None):
+    """Let Doc.from_bytes read data stores."""
+    if isinstance(obj, dict) and MARKER in obj:
+        return DataStore.from_dict(obj)
+    return obj if chain is None else chain(obj)
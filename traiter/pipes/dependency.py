@@ -2,13 +2,16 @@
 
 from array import array
 from collections import defaultdict
-from typing import Union
+from itertools import accumulate
+from typing import Callable, Union
 
+import numpy as np
 import spacy
 from spacy.language import Language
 from spacy.matcher import DependencyMatcher
-from spacy.tokens import Span, Token
+from spacy.tokens import Doc, Span, Token
 
+from traiter.pipes.link_table import add_link, span_links, token_links
 from traiter.util import as_list, sign
 
 DEPENDENCY = 'dependency'
@@ -16,6 +19,13 @@ NEAREST_ANCHOR = 'nearest_anchor.v1'
 
 DependencyPatterns = Union[dict, list[dict]]
 
+# Takes (anchor indexes, entity indexes, doc) & returns (distances, signs) matrices
+Metric = Callable[[np.ndarray, np.ndarray, Doc], tuple]
+
+TOKEN_PENALTY = 'token_penalty'
+TOKEN_DISTANCE = 'token_distance'
+ENTITY_DISTANCE = 'entity_distance'
+
 NEVER = 9999
 PENALTY = {
     ',': 2,
@@ -25,10 +35,14 @@ PENALTY = {
 
 
 def add_extensions():
-    """Add extensions for spans and tokens used by entity linker pipes."""
+    """Add extensions for spans and tokens used by entity linker pipes.
+
+    The links are kept in a doc level table, see link_table.py. So _.links is
+    read only, use add_link() to add links.
+    """
     if not Span.has_extension('links'):
-        Span.set_extension('links', default=defaultdict(list))
-        Token.set_extension('links', default=defaultdict(list))
+        Span.set_extension('links', getter=span_links)
+        Token.set_extension('links', getter=token_links)
 
 
 @Language.factory(DEPENDENCY)
@@ -42,6 +56,7 @@ class Dependency:
         patterns = as_list(patterns)
         self.dispatch = self.build_dispatch_table(patterns)
         self.build_matchers(patterns)
+        self.requires = self.build_requirements(patterns)
         add_extensions()
 
     def build_matchers(self, patterns: DependencyPatterns):
@@ -61,7 +76,39 @@ class Dependency:
                 dispatch[label] = (func, on_match.get('kwargs', {}))
         return dispatch
 
+    @staticmethod
+    def build_requirements(patterns: DependencyPatterns) -> list[list[frozenset]]:
+        """Get the entity labels each pattern needs.
+
+        Every node in a pattern must match a token. So if a node's RIGHT_ATTRS
+        limits the token's ENT_TYPE then one of those labels must be in the doc.
+        A pattern's requirements are a list of these sets of labels.
+        """
+        requires = []
+        for matcher in patterns:
+            for pattern in matcher['patterns']:
+                clauses = []
+                for node in pattern:
+                    attrs = node.get('RIGHT_ATTRS', {})
+                    attrs = {k.upper(): v for k, v in attrs.items()}
+                    ent_type = attrs.get('ENT_TYPE')
+                    if isinstance(ent_type, dict) and list(ent_type) == ['IN']:
+                        ent_type = ent_type['IN']
+                    if isinstance(ent_type, str) and ent_type:
+                        clauses.append(frozenset([ent_type]))
+                    elif isinstance(ent_type, list) and all(ent_type):
+                        clauses.append(frozenset(ent_type))
+                requires.append(clauses)
+        return requires
+
+    def can_match(self, labels: set[str]) -> bool:
+        """Do the entity labels satisfy the requirements of any pattern?"""
+        return any(all(c & labels for c in r) for r in self.requires)
+
     def __call__(self, doc):
+        if not self.can_match({e.label_ for e in doc.ents}):
+            return doc
+
         matches = self.matcher(doc)
 
         if not self.dispatch:
@@ -86,6 +133,9 @@ def nearest_anchor(doc, matches, **kwargs):
         1) Create a set of matched entities from matches of tokens.
         2) Find all entities.
         2) Link entities to closest anchor entity. There are different distance metrics.
+
+    Choose the metric with the "metric" kwarg, see METRICS. It defaults to
+    token_penalty.
     """
     # print(kwargs)
     # print(matches)
@@ -115,17 +165,124 @@ def nearest_anchor(doc, matches, **kwargs):
         ent_idx |= {e for t in token_ids if (e := token_2_ent[t]) > -1}
         anchor_idx |= {e for t in token_ids if (e := anchor_2_ent[t]) > -1}
 
+    if not ent_idx or not anchor_idx:
+        return
+
     # Find the closest anchor entity to the target entity
-    for e in ent_idx:
-        if not doc.ents[e]._.data.get(anchor):
-            nearest = [(token_penalty(a, e, doc), a) for a in anchor_idx]
-            nearest = [n for n in nearest if n[0][0] < NEVER]
-            if nearest:
-                nearest = sorted(nearest)[0][1]
-                doc.ents[e]._.data[anchor] = doc.ents[nearest]._.data[anchor]
-                nearest = doc.ents[nearest]
-                doc.ents[e]._.links[f'{anchor}_link'].append(
-                    (nearest.start_char, nearest.end_char))
+    ents = doc.ents
+    todo = [e for e in sorted(ent_idx) if not ents[e]._.data.get(anchor)]
+    if not todo:
+        return
+
+    anchors = np.array(sorted(anchor_idx))
+    entities = np.array(todo)
+    name = kwargs.get('metric', TOKEN_PENALTY)
+    if name in NEIGHBOR_METRICS:
+        anchors = neighbors(anchors, entities)
+    dist, signs = get_metric(name)(anchors, entities, doc)
+    dist = np.where(anchors >= 0, dist, NEVER)
+
+    for e, nearest in zip(todo, closest(anchors, dist, signs)):
+        if nearest >= 0:
+            ents[e]._.data[anchor] = ents[nearest]._.data[anchor]
+            add_link(ents[e], ents[nearest], f'{anchor}_link')
+
+
+def closest(anchors: np.ndarray, dist: np.ndarray, signs: np.ndarray) -> np.ndarray:
+    """Get the closest anchor for each entity (row) or -1 if there is none.
+
+    The anchors are either all anchors for every entity or a matrix with the
+    anchors tried for each entity, see neighbors(). This breaks ties like sorting
+    ((dist, sign), anchor) tuples. The anchor before the entity wins over the one
+    after it and then the first anchor wins.
+    """
+    dist = np.where(dist < NEVER, dist, np.inf)
+    best = dist.min(axis=1, keepdims=True)
+    signs = np.where(dist == best, signs, 2)
+    first = (signs == signs.min(axis=1, keepdims=True)).argmax(axis=1)
+    anchors = np.broadcast_to(anchors, dist.shape)
+    nearest = np.take_along_axis(anchors, first[:, np.newaxis], axis=1)[:, 0]
+    return np.where(np.isfinite(best[:, 0]), nearest, -1)
+
+
+def neighbors(anchors: np.ndarray, entities: np.ndarray) -> np.ndarray:
+    """Get the closest anchor before and after each entity, -1 if there is none.
+
+    With token_penalty and token_distance the distance only grows as we move away
+    from the entity. So the best anchor is one of these two and we only score them
+    instead of every anchor. The anchors must be sorted.
+    """
+    idx = np.searchsorted(anchors, entities)
+    padded = np.concatenate(([-1], anchors, [-1]))
+    return np.stack((padded[idx], padded[idx + 1]), axis=1)
+
+
+def get_metric(name: str) -> Metric:
+    """Get a distance metric by name.
+
+    Other metrics may be registered in spacy.registry.misc. They work on one
+    (anchor, entity) pair at a time like token_penalty() etc.
+    """
+    if name in METRICS:
+        return METRICS[name]
+    return pairwise(spacy.registry.misc.get(name))
+
+
+def pairwise(func: Callable) -> Metric:
+    """Build a distance matrix from a metric that works on one pair at a time."""
+
+    def _metric(anchors, entities, doc):
+        pairs = [[func(int(a), int(e), doc) for a in anchors] for e in entities]
+        dist = np.array([[p[0] for p in row] for row in pairs], dtype=float)
+        signs = np.array([[p[1] for p in row] for row in pairs])
+        return dist, signs
+
+    return _metric
+
+
+def penalty_sums(doc) -> np.ndarray:
+    """Get the running total of the punctuation penalties before each token."""
+    penalties = accumulate((PENALTY.get(t.text, 0) for t in doc), initial=0)
+    return np.fromiter(penalties, dtype=np.int64, count=len(doc) + 1)
+
+
+def gaps(anchors: np.ndarray, entities: np.ndarray, doc):
+    """Get the tokens on both sides of the gap between each entity and anchor.
+
+    Returns the last token of the earlier span, the first token of the later span,
+    and the sign of the anchor's direction from the entity. Entities are rows.
+    """
+    ents = doc.ents
+    firsts = np.fromiter((e.start for e in ents), dtype=np.int64, count=len(ents))
+    lasts = np.fromiter((e.end - 1 for e in ents), dtype=np.int64, count=len(ents))
+    anchors, entities = as_rows(anchors), entities[:, np.newaxis]
+    lo = lasts[np.minimum(anchors, entities)]
+    hi = firsts[np.maximum(anchors, entities)]
+    return lo, hi, np.sign(anchors - entities)
+
+
+def token_penalty_matrix(anchors: np.ndarray, entities: np.ndarray, doc):
+    """Calculate token_penalty() for every entity and anchor at once."""
+    lo, hi, signs = gaps(anchors, entities, doc)
+    sums = penalty_sums(doc)
+    return hi - lo + sums[hi] - sums[lo + 1], signs
+
+
+def token_distance_matrix(anchors: np.ndarray, entities: np.ndarray, doc):
+    """Calculate token_distance() for every entity and anchor at once."""
+    lo, hi, signs = gaps(anchors, entities, doc)
+    return hi - lo, signs
+
+
+def entity_distance_matrix(anchors: np.ndarray, entities: np.ndarray, _):
+    """Calculate entity_distance() for every entity and anchor at once."""
+    dist = as_rows(anchors) - entities[:, np.newaxis]
+    return np.abs(dist), np.sign(dist)
+
+
+def as_rows(anchors: np.ndarray) -> np.ndarray:
+    """Shape the anchors so that they broadcast against a column of entities."""
+    return anchors if anchors.ndim == 2 else anchors[np.newaxis, :]
 
 
 def token_penalty(anchor_i, entity_i, doc):
@@ -148,3 +305,13 @@ def entity_distance(anchor_i, entity_i, _):
     """Calculate the distance in token offset from the anchor to the entity."""
     dist = anchor_i - entity_i
     return abs(dist), sign(dist)
+
+
+METRICS: dict[str, Metric] = {
+    TOKEN_PENALTY: token_penalty_matrix,
+    TOKEN_DISTANCE: token_distance_matrix,
+    ENTITY_DISTANCE: entity_distance_matrix,
+}
+
+# Metrics where only the anchors next to the entity need to be scored
+NEIGHBOR_METRICS = (TOKEN_PENALTY, TOKEN_DISTANCE)
@@ -1,24 +1,35 @@
 """Common functions for entity data pipes."""
+from functools import partial
 from typing import Union
 
 from spacy.tokens import Span, Token
 
+from traiter.pipes.data_store import get_data, get_label, set_data, set_label
+
 EntityPatterns = Union[dict, list[dict]]
 
 
 def add_extensions():
-    """Add extensions for spans and tokens used by entity data pipes."""
+    """Add extensions for spans and tokens used by entity data pipes.
+
+    The data and labels for all entities are kept in doc level stores, see
+    data_store.py.
+    """
     if not Span.has_extension('data'):
-        Span.set_extension('data', default={})
-        Token.set_extension('data', default={})
+        Span.set_extension('data', getter=get_data, setter=set_data)
+        Token.set_extension('data', getter=get_data, setter=set_data)
 
     if not Span.has_extension('new_label'):
-        Span.set_extension('new_label', default='')
-        Token.set_extension('new_label', default='')
+        getter = partial(get_label, field='new_label')
+        setter = partial(set_label, field='new_label')
+        Span.set_extension('new_label', getter=getter, setter=setter)
+        Token.set_extension('new_label', getter=getter, setter=setter)
 
     if not Span.has_extension('cached_label'):
-        Span.set_extension('cached_label', default='')
-        Token.set_extension('cached_label', default='')
+        getter = partial(get_label, field='cached_label')
+        setter = partial(set_label, field='cached_label')
+        Span.set_extension('cached_label', getter=getter, setter=setter)
+        Token.set_extension('cached_label', getter=getter, setter=setter)
 
 
 class EntityData:
@@ -32,14 +43,14 @@ class EntityData:
     def relabel_entity(ent, old_label):
         """Relabel an entity.
 
-        We cannot change a label on a span so we have to make a new one.
+        We cannot change a label on a span so we have to make a new one. The new
+        span has the same offsets so it already shares the old span's data.
         """
         label = old_label
 
         if new_label := ent._.new_label:
             label = new_label
             span = Span(ent.doc, ent.start, ent.end, label=new_label)
-            span._.data = ent._.data
             span._.new_label = ''
             ent = span
             if (move := span._.data.get(old_label)) is not None:
@@ -0,0 +1,216 @@
+"""Hold the links between entities for a whole doc.
+
+Linker pipes used to append (start_char, end_char) tuples to a defaultdict on every
+linked span. Large docs then allocate a dict and a list per linked entity. Here we
+keep all of a doc's links in typed arrays, one row per link:
+
+    source kind, source start char, source end char,
+    target start char, target end char, type
+
+Entities are rebuilt when they are relabeled so we refer to them by their character
+offsets and not by their index in doc.ents. A token and a one token span have the
+same offsets, so the source kind (SPAN or TOKEN) keeps their links apart, like the
+row keys in data_store.py.
+
+The table is kept in doc.user_data and it can be written with Doc.to_bytes. The
+_.links extension is a read only view of the table, so add links with add_link().
+"""
+
+from array import array
+from collections import defaultdict
+from collections.abc import Mapping
+from typing import Iterator, Optional, Union
+
+import srsly
+from spacy.tokens import Doc, Span, Token
+
+from traiter.pipes.data_store import SPAN, RowKey, row_key
+
+LINKS = 'traiter_links'  # The key for the link table in doc.user_data
+MARKER = '__link_table__'  # Marks a serialized link table
+COLUMNS = (
+    'source_kind', 'source_start', 'source_end', 'target_start', 'target_end', 'type')
+
+READ_ONLY = '_.links is read only, use traiter.pipes.link_table.add_link()'
+
+Offsets = tuple[int, int]
+
+
+class Targets(tuple):
+    """The targets of one type of link. Appending to them is an error."""
+
+    __slots__ = ()
+
+    def append(self, _) -> None:
+        """Do not add links here."""
+        raise TypeError(READ_ONLY)
+
+    def extend(self, _) -> None:
+        """Do not add links here."""
+        raise TypeError(READ_ONLY)
+
+
+EMPTY = Targets()
+
+
+class Links(Mapping):
+    """A read only view of the links from a span or token.
+
+    Link types that are missing look like empty tuples, like the defaultdict
+    the old _.links extension returned. Writing to the view or to its targets
+    raises a TypeError instead of silently losing the link.
+    """
+
+    __slots__ = ('_links',)
+
+    def __init__(self, links: Optional[dict[str, Targets]] = None) -> None:
+        self._links = links if links else {}
+
+    def __getitem__(self, link_type: str) -> Targets:
+        return self._links.get(link_type, EMPTY)
+
+    def __setitem__(self, link_type: str, targets) -> None:
+        raise TypeError(READ_ONLY)
+
+    def __delitem__(self, link_type: str) -> None:
+        raise TypeError(READ_ONLY)
+
+    def __contains__(self, link_type) -> bool:
+        return link_type in self._links
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._links)
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    def __repr__(self) -> str:
+        return f'Links({self._links!r})'
+
+    def get(self, link_type: str, default=None):
+        return self._links.get(link_type, default)
+
+
+class LinkTable:
+    """All of the links in a doc."""
+
+    def __init__(self) -> None:
+        self.source_kind = array('b')
+        self.source_start = array('q')
+        self.source_end = array('q')
+        self.target_start = array('q')
+        self.target_end = array('q')
+        self.type = array('i')
+        self.types: list[str] = []  # Link type names indexed by the type column
+        self._type_ids: dict[str, int] = {}
+        self._index: Optional[dict[RowKey, list[int]]] = None
+
+    def __len__(self) -> int:
+        return len(self.type)
+
+    def add(self, source: RowKey, target: Offsets, link_type: str) -> None:
+        """Link the source span or token to the target offsets."""
+        if (type_id := self._type_ids.get(link_type)) is None:
+            type_id = self._type_ids[link_type] = len(self.types)
+            self.types.append(link_type)
+        self.source_kind.append(source[0])
+        self.source_start.append(source[1])
+        self.source_end.append(source[2])
+        self.target_start.append(target[0])
+        self.target_end.append(target[1])
+        self.type.append(type_id)
+        self._index = None
+
+    def links(self, source: RowKey) -> Links:
+        """Get the links from the span or token with the given row key.
+
+        Link types map to tuples of target offsets. Reading a missing type gives
+        an empty tuple, like the old _.links extension.
+        """
+        if self._index is None:
+            self._index = defaultdict(list)
+            keys = zip(self.source_kind, self.source_start, self.source_end)
+            for i, key in enumerate(keys):
+                self._index[key].append(i)
+
+        links = defaultdict(list)
+        for i in self._index.get(source, []):
+            target = (self.target_start[i], self.target_end[i])
+            links[self.types[self.type[i]]].append(target)
+        return Links({k: Targets(v) for k, v in links.items()})
+
+    def columns(self) -> dict[str, array]:
+        """Get all of the links as columns for exporting in bulk."""
+        return {c: getattr(self, c) for c in COLUMNS}
+
+    def to_dict(self) -> dict:
+        """Convert the table to something msgpack can write."""
+        return {
+            MARKER: {c: getattr(self, c).tobytes() for c in COLUMNS},
+            'types': self.types,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'LinkTable':
+        """Rebuild a table from to_dict() output.
+
+        Tables written before links had a source kind only had links from spans.
+        """
+        table = cls()
+        for column in COLUMNS[1:]:
+            getattr(table, column).frombytes(data[MARKER][column])
+        if (kinds := data[MARKER].get('source_kind')) is not None:
+            table.source_kind.frombytes(kinds)
+        else:
+            table.source_kind.extend([SPAN] * len(table.type))
+        table.types = list(data['types'])
+        table._type_ids = {t: i for i, t in enumerate(table.types)}
+        return table
+
+    def __reduce__(self) -> tuple:
+        return self.from_dict, (self.to_dict(),)
+
+
+def get_table(doc: Doc) -> LinkTable:
+    """Get the doc's link table, adding an empty one if needed."""
+    if (table := doc.user_data.get(LINKS)) is None:
+        table = doc.user_data[LINKS] = LinkTable()
+    return table
+
+
+def add_link(
+        source: Union[Span, Token], target: Union[Span, Token], link_type: str
+) -> None:
+    """Link an entity or token to another one."""
+    _, start, end = row_key(target)
+    get_table(source.doc).add(row_key(source), (start, end), link_type)
+
+
+def span_links(span: Span) -> Links:
+    """Get the links from a span. Add links with add_link()."""
+    if (table := span.doc.user_data.get(LINKS)) is None:
+        return Links()
+    return table.links(row_key(span))
+
+
+def token_links(token: Token) -> Links:
+    """Get the links from a token. Add links with add_link()."""
+    if (table := token.doc.user_data.get(LINKS)) is None:
+        return Links()
+    return table.links(row_key(token))
+
+
+@srsly.msgpack_encoders(LINKS)
+def encode_links(obj, chain=None):
+    """Let Doc.to_bytes write link tables."""
+    if isinstance(obj, LinkTable):
+        return obj.to_dict()
+    return obj if chain is None else chain(obj)
+
+
+@srsly.msgpack_decoders(LINKS)
+def decode_links(obj, chain=None):
+    """Let Doc.from_bytes read link tables."""
+    if isinstance(obj, dict) and MARKER in obj:
+        return LinkTable.from_dict(obj)
+    return obj if chain is None else chain(obj)
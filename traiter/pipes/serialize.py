@@ -0,0 +1,34 @@
+"""Write the traiter extensions of a doc as compact bytes.
+
+The _.data, _.new_label, _.cached_label, and _.links extensions are all backed by
+doc level stores in doc.user_data, see data_store.py and link_table.py. Those stores
+register msgpack hooks, so Doc.to_bytes, DocBin(store_user_data=True), and
+nlp.pipe(n_process=N) already carry them as typed columns.
+
+Use these functions to save or move just the traiter state of a doc, for instance to
+cache it next to a DocBin written without user data.
+"""
+
+import srsly
+from spacy.tokens import Doc
+
+from traiter.pipes.data_store import DATA, LABELS
+from traiter.pipes.link_table import LINKS
+
+VERSION = 1
+STATE = (DATA, LABELS, LINKS)  # The doc.user_data keys that we write
+
+
+def to_bytes(doc: Doc) -> bytes:
+    """Write the traiter extension state of a doc."""
+    state = {k: doc.user_data[k] for k in STATE if k in doc.user_data}
+    return srsly.msgpack_dumps({'version': VERSION, 'state': state})
+
+
+def from_bytes(doc: Doc, data: bytes) -> Doc:
+    """Read traiter extension state written by to_bytes() into a doc."""
+    msg = srsly.msgpack_loads(data)
+    if msg['version'] != VERSION:
+        raise ValueError(f'Unknown traiter state version: {msg["version"]}')
+    doc.user_data.update(msg['state'])
+    return doc
@@ -0,0 +1,99 @@
+"""Stream records from large CSV and JSONL files through a traiter pipeline.
+
+Field note downloads are often several gigabytes. Everything here is a generator, so
+rows are read, cleaned, parsed, and written a batch at a time and memory use does not
+grow with the size of the input. Files ending in .gz are read and written with gzip.
+"""
+
+import csv
+import gzip
+import json
+from pathlib import Path
+from typing import IO, Iterable, Iterator, Optional, Union
+
+from traiter import runner
+from traiter.util import clean_text
+
+CSV = 'csv'
+TSV = 'tsv'
+JSONL = 'jsonl'
+FORMATS = {'.csv': CSV, '.tsv': TSV, '.jsonl': JSONL, '.ndjson': JSONL}
+
+FIELD_LIMIT = 10_000_000  # The longest CSV field we will read
+
+PathLike = Union[str, Path]
+
+
+def open_file(path: PathLike, mode: str = 'r') -> IO:
+    """Open a text file, using gzip if the file name ends with .gz."""
+    path = Path(path)
+    opener = gzip.open if path.suffix == '.gz' else open
+    newline = '' if 'r' in mode else None  # Let the csv module handle newlines
+    return opener(path, mode + 't', encoding='utf-8', newline=newline)
+
+
+def file_format(path: PathLike) -> str:
+    """Get a file's format from its name, ignoring a .gz suffix."""
+    path = Path(path)
+    suffix = Path(path.stem).suffix if path.suffix == '.gz' else path.suffix
+    if (format_ := FORMATS.get(suffix.lower())) is None:
+        raise ValueError(f'Unknown file format: {path}')
+    return format_
+
+
+def read_rows(path: PathLike) -> Iterator[dict]:
+    """Read the rows of a CSV, TSV, or JSONL file one at a time."""
+    format_ = file_format(path)
+    with open_file(path) as in_file:
+        if format_ == JSONL:
+            yield from (json.loads(ln) for ln in in_file if ln.strip())
+        else:
+            csv.field_size_limit(max(csv.field_size_limit(), FIELD_LIMIT))
+            delimiter = '\t' if format_ == TSV else ','
+            yield from csv.DictReader(in_file, delimiter=delimiter)
+
+
+def read_records(
+        path: PathLike,
+        id_field: str,
+        text_field: str,
+        trans: Optional[dict] = None,
+) -> Iterator[runner.Record]:
+    """Read (id, cleaned text) records from a file for runner.run()."""
+    for row in read_rows(path):
+        yield row[id_field], clean_text(row.get(text_field), trans=trans)
+
+
+def write_results(results: Iterable[runner.Result], path: PathLike) -> int:
+    """Write results to a JSONL file as they arrive and return how many there were.
+
+    Each line is {"id": record ID, "result": extracted value}.
+    """
+    count = 0
+    with open_file(path, 'w') as out_file:
+        for id_, result in results:
+            out_file.write(json.dumps({'id': id_, 'result': result}) + '\n')
+            count += 1
+    return count
+
+
+def extract(
+        in_path: PathLike,
+        out_path: PathLike,
+        loader: runner.Loader,
+        id_field: str,
+        text_field: str,
+        extract_: runner.Extract = runner.entities,
+        workers: int = 1,
+        batch_size: int = runner.BATCH,
+        trans: Optional[dict] = None,
+) -> int:
+    """Read, clean, parse, and write every record in a file.
+
+    See runner.run() for the loader, extract_, workers, and batch_size arguments.
+    Returns the number of records written.
+    """
+    records = read_records(in_path, id_field, text_field, trans=trans)
+    results = runner.run(
+        records, loader, extract=extract_, workers=workers, batch_size=batch_size)
+    return write_results(results, out_path)
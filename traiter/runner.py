@@ -0,0 +1,116 @@
+"""Run a traiter pipeline over a large set of records using several processes.
+
+Records are (id, text) pairs. We split them into batches and send the batches to a
+pool of worker processes. Each worker loads the pipeline once, runs nlp.pipe on its
+batches, and sends back only the extracted results, not the docs. Results come back
+in the same order as the records.
+
+Only a few batches are in flight at a time, so records are read from the input as
+the workers need them and memory stays bounded even for huge inputs.
+"""
+
+import multiprocessing
+from collections import deque
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Hashable, Iterable, Iterator, Optional, Union
+
+import spacy
+from spacy.language import Language
+from spacy.tokens import Doc
+
+BATCH = 1_000  # How many records to send to a worker at a time
+PIPE_BATCH = 64  # The batch size for nlp.pipe inside a worker
+
+Record = tuple[Hashable, str]  # (record ID, text)
+Result = tuple[Hashable, Any]  # (record ID, extracted value)
+Loader = Union[str, Path, Callable[[], Language]]
+Extract = Callable[[Doc], Any]
+
+# The pipeline in a worker process: (nlp, extract function, nlp.pipe batch size)
+WORKER_PIPELINE: Optional[tuple[Language, Extract, int]] = None
+
+
+def entities(doc: Doc) -> list[dict]:
+    """Get the entities from a doc as plain dicts, the default extract function."""
+    ents = []
+    for ent in doc.ents:
+        ent_data = dict(ent._.data) if ent.has_extension('data') else {}
+        ents.append({
+            'label': ent.label_,
+            'start': ent.start_char,
+            'end': ent.end_char,
+            'data': ent_data,
+        })
+    return ents
+
+
+def load(loader: Loader) -> Language:
+    """Load a pipeline from a model name, a path, or a function."""
+    if isinstance(loader, (str, Path)):
+        return spacy.load(loader)
+    return loader()
+
+
+def run(
+        records: Iterable[Record],
+        loader: Loader,
+        extract: Extract = entities,
+        workers: int = 1,
+        batch_size: int = BATCH,
+        max_pending: Optional[int] = None,
+        pipe_batch: int = PIPE_BATCH,
+) -> Iterator[Result]:
+    """Run the pipeline on the records and yield the results in record order.
+
+    The loader and extract function are sent to the workers so they must be
+    picklable, i.e. module level functions, or the loader can be a spaCy model name
+    or path.
+
+    records     = An iterable of (id, text) pairs, it is consumed lazily
+    loader      = Builds the pipeline in each worker
+    extract     = Gets the result to keep from each doc
+    workers     = The number of worker processes. 1 = run in this process
+    batch_size  = How many records to send to a worker at a time
+    max_pending = The most batches in flight, defaults to 2 per worker
+    pipe_batch  = The batch size for nlp.pipe
+    """
+    records = iter(records)
+
+    if workers <= 1:
+        nlp = load(loader)
+        while batch := list(islice(records, batch_size)):
+            yield from pipe(nlp, extract, pipe_batch, batch)
+        return
+
+    max_pending = max_pending if max_pending else 2 * workers
+    args = (loader, extract, pipe_batch)
+
+    with multiprocessing.Pool(workers, init_worker, args) as pool:
+        pending = deque()
+        while batch := list(islice(records, batch_size)):
+            pending.append(pool.apply_async(run_batch, (batch,)))
+            if len(pending) >= max_pending:  # Wait before reading more records
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def pipe(
+        nlp: Language, extract: Extract, pipe_batch: int, batch: list[Record]
+) -> list[Result]:
+    """Run the pipeline on a batch of records."""
+    ids = [r[0] for r in batch]
+    docs = nlp.pipe((r[1] for r in batch), batch_size=pipe_batch)
+    return [(id_, extract(doc)) for id_, doc in zip(ids, docs)]
+
+
+def init_worker(loader: Loader, extract: Extract, pipe_batch: int) -> None:
+    """Load the pipeline once per worker process."""
+    global WORKER_PIPELINE  # pylint: disable=global-statement
+    WORKER_PIPELINE = (load(loader), extract, pipe_batch)
+
+
+def run_batch(batch: list[Record]) -> list[Result]:
+    """Run the worker's pipeline on a batch of records."""
+    return pipe(*WORKER_PIPELINE, batch)
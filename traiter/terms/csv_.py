@@ -13,11 +13,13 @@ Columns for a vocabulary CSV file:
 
 import csv
 from pathlib import Path
-from typing import Optional, Union
+from typing import Callable, Optional, Union
 
 from hyphenate import hyphenate_word
 
 import traiter.vocabulary as vocab
+from . import vocab_cache
+from .term_store import TermStore
 from ..const import DASH_CHAR
 
 # This points to the traiter vocabulary files
@@ -29,29 +31,91 @@ StrList = Union[str, list[str]]
 PathList = Union[str, list[str], Path, list[Path]]
 OptStrList = Optional[StrList]
 
+# How a term set was built as JSON values, see Csv.recipe. For example:
+#   ['hyphenate_terms', ['read_csv', ['color']], {}]
+Recipe = list
+
 
 class Csv:
     """A dictionary of terms."""
 
     def __init__(self, terms: Optional[list[dict]] = None) -> None:
-        self.terms = terms if terms else []
+        self._store = TermStore(terms)
+        self._recipe: Optional[Recipe] = None
+        self._sources: list[Path] = []
+        self._version = 0  # The store's version when the recipe was set
 
     def __iter__(self):
-        yield from self.terms
+        yield from self._store
+
+    def __len__(self) -> int:
+        return len(self._store)
 
     def __add__(self, other: 'Csv') -> 'Csv':
-        self.terms += other.terms
+        recipe = None
+        if self.recipe is not None and other.recipe is not None:
+            recipe = ['add', self.recipe, other.recipe]
+        sources = self.sources + other.sources
+        self._store.extend(list(other))
+        return self._set_recipe(recipe, sources)
+
+    @property
+    def recipe(self) -> Optional[Recipe]:
+        """Get how the terms were built, None = we do not know.
+
+        Terms read from CSV files, and terms derived from them with functions like
+        hyphenate_terms(), know how they were built. The recipe and the contents of
+        the source files are the vocabulary cache key for terms derived from these.
+        Changing the terms in any way forgets the recipe.
+        """
+        return self._recipe if self._store.version == self._version else None
+
+    @property
+    def sources(self) -> list[Path]:
+        """Get the files that the terms were built from, if we know the recipe."""
+        return self._sources if self.recipe is not None else []
+
+    def _set_recipe(self, recipe: Optional[Recipe], sources: list[Path]) -> 'Csv':
+        self._recipe = recipe
+        self._sources = list(sources)
+        self._version = self._store.version
         return self
 
+    @property
+    def terms(self) -> TermStore:
+        """Get all of the terms.
+
+        This is the list that holds the terms, not a copy, and changing it updates
+        the indexes. Terms are indexed by label, pattern, and attr, so if you change
+        one of those fields in a term you must call reindex().
+        """
+        return self._store
+
+    @terms.setter
+    def terms(self, terms: list[dict]) -> None:
+        if terms is not self._store:  # terms += [...] sets the same list back
+            self._store = TermStore(terms)
+            self._recipe = None
+
+    def append(self, term: dict) -> None:
+        """Add a term."""
+        self._store.append(term)
+
+    def extend(self, terms: list[dict]) -> None:
+        """Add several terms."""
+        self._store.extend(terms)
+
+    def reindex(self) -> None:
+        """Update the indexes after changing a label, pattern, or attr in a term."""
+        self._store.reindex()
+
     def with_pattern(self, pattern: str = '') -> list[dict]:
         """Given a pattern get the term."""
-        terms = [t for t in self.terms if t['pattern'] == pattern]
-        return terms
+        return self._store.find('pattern', pattern)
 
     def with_label(self, label: str = '') -> list[dict]:
         """Given a pattern get the term."""
-        terms = [t for t in self.terms if t['label'] == label]
-        return terms
+        return self._store.find('label', label)
 
     def patterns_with_label(self, label: str = '') -> list[str]:
         """Get all patterns with the given label."""
@@ -65,32 +129,43 @@ class Csv:
         with a preposition so we could: term.drop('in', field='pattern').
         """
         drops = drops.split() if isinstance(drops, str) else drops
-        self.terms = [t for t in self.terms if t[field] not in drops]
+        self._store.drop(field, drops)
 
     def for_entity_ruler(self, attr: str = 'LOWER'):
         """Return ruler pattens from the terms."""
-        attr = attr.upper()
         rules = [{'label': t['label'], 'pattern': t['pattern']}
-                 for t in self.terms if t['attr'].upper() == attr]
+                 for t in self._store.find('attr', attr)]
         return rules
 
     def pattern_dict(self, column: str) -> dict[str, dict]:
         """Create a dict from a column in the terms."""
-        return {t['pattern']: v for t in self.terms
+        return {t['pattern']: v for t in self._store
                 if (v := t.get(column)) not in (None, '')}
 
     ###########################################################################
     # Other constructors
 
     @classmethod
-    def read_csv(cls, paths: PathList, labels: OptStrList = None) -> 'Csv':
-        """Read a CSV file."""
-        terms = cls()
+    def read_csv(
+            cls, paths: PathList, labels: OptStrList = None, cache: bool = False
+    ) -> 'Csv':
+        """Read a CSV file.
+
+        Set cache to keep the parsed terms in the vocabulary cache.
+        """
+        paths = as_paths(paths)
+        labels = labels.split() if isinstance(labels, str) else labels
+        labels = labels if labels else None
 
-        if isinstance(paths, str):
-            paths = paths.split()
-        elif isinstance(paths, Path):
-            paths = [paths]
+        if cache:
+            terms = cls.cached(
+                paths,
+                lambda: cls.read_csv(paths),
+                params={'recipe': ['read_csv', None]},
+                labels=labels)
+            return terms._set_recipe(['read_csv', labels], paths)
+
+        terms = cls()
 
         for path in paths:
             with open(path) as term_file:
@@ -98,7 +173,6 @@ class Csv:
                 new_terms = list(reader)
 
             if labels:
-                labels = labels if isinstance(labels, list) else labels.split()
                 new_terms = [t for t in new_terms if t['label'] in labels]
 
             for term in new_terms:
@@ -107,18 +181,21 @@ class Csv:
 
             terms += cls(terms=new_terms)
 
-        return terms
+        return terms._set_recipe(['read_csv', labels], paths)
 
     @classmethod
-    def shared(cls, names: StrList, labels: OptStrList = None) -> 'Csv':
+    def shared(
+            cls, names: StrList, labels: OptStrList = None, cache: bool = False
+    ) -> 'Csv':
         """Get the path to a shared vocabulary file.
             shared: Names (possibly abbreviated) of the the shared files to include.
             label:  A list of labels to include from the files. None = all
+            cache:  Keep the parsed terms in the vocabulary cache
         """
         names = names.split() if isinstance(names, str) else names
         labels = labels.split() if isinstance(labels, str) else labels
 
-        terms = cls()
+        paths = []
 
         for name in names:
 
@@ -129,23 +206,100 @@ class Csv:
                 err += ' '.join(f'"{s.stem}"' for s in SHARED_CSV)
                 raise Exception(err)
 
-            path = path_set.pop()
+            paths.append(path_set.pop())
 
-            terms += cls.read_csv(path, labels)
+        return cls.read_csv(paths, labels, cache=cache)
 
-        return terms
+    @classmethod
+    def cached(
+            cls,
+            paths: PathList,
+            build: Callable[[], 'Csv'],
+            params: Optional[dict] = None,
+            labels: OptStrList = None,
+            cache_dir: Optional[Union[str, Path]] = None,
+    ) -> 'Csv':
+        """Get terms from the vocabulary cache or build them and cache them.
+
+        The cache key is the contents of the source files, the build function's
+        name, and the params. Nothing else about the build function is in the key.
+        So the params must describe everything else that changes the terms, and
+        they are required when the build function is a lambda or a local function.
+        The derivations, like hyphenate_terms(), do this for you with cache=True:
+            Csv.hyphenate_terms(Csv.read_csv(paths), cache=True)
+
+        paths     = The source files of the terms, their contents are in the cache key
+        build     = Builds all of the terms when they are not in the cache
+        params    = JSON values that say how the terms are built from the files
+        labels    = Only get terms with these labels. None = all
+        cache_dir = Where to put the cache files, defaults to VOCAB_CACHE_DIR
+        """
+        paths = as_paths(paths)
+        labels = labels.split() if isinstance(labels, str) else labels
+        labels = labels if labels else None
+
+        params = params if params else {}
+        qualname = getattr(build, '__qualname__', '<')
+        name = None if '<' in qualname else f'{build.__module__}.{qualname}'
+        if name is None and not params:  # Lambdas etc. are not unique by name
+            raise ValueError('Give params that describe a lambda or local build')
+        key = vocab_cache.cache_key(paths, {'build': name, 'params': params})
+        path = vocab_cache.cache_path(key, cache_dir)
+
+        terms = vocab_cache.read(path, labels)
+
+        if terms is None:
+            built = build()
+            try:
+                vocab_cache.write(path, built)
+            except OSError:
+                pass  # Not being able to cache the terms is not an error
+            terms = [t for t in built if labels is None or t['label'] in labels]
+
+        terms = cls(terms=terms)
+        return terms._set_recipe(['cached', name, params, labels], paths)
 
     @classmethod
-    def hyphenate_terms(cls, other: 'Csv') -> 'Csv':
+    def cached_step(
+            cls,
+            step: str,
+            other: 'Csv',
+            params: dict,
+            build: Callable[[], 'Csv'],
+    ) -> 'Csv':
+        """Get terms derived from another term set from the vocabulary cache.
+
+        The step and params say how the terms are derived. If we do not know the
+        other term set's recipe then we cannot key the cache and we just build the
+        terms.
+        """
+        if other.recipe is None:
+            return build()
+        recipe = [step, other.recipe, params]
+        terms = cls.cached(other.sources, build, {'recipe': recipe})
+        return terms._set_recipe(recipe, other.sources)
+
+    def _derived(self, step: str, other: 'Csv', params: dict) -> 'Csv':
+        recipe = None if other.recipe is None else [step, other.recipe, params]
+        return self._set_recipe(recipe, other.sources)
+
+    @classmethod
+    def hyphenate_terms(cls, other: 'Csv', cache: bool = False) -> 'Csv':
         """Systematically handle hyphenated terms.
 
         We cannot depend on terms being present in a contiguous form. We need a
         systematic method for handling hyphenated terms. The hyphenate library is
         great for this but sometimes we need to handle non-standard hyphenations
         manually. Non-standard hyphenations are stored in the terms CSV file.
+
+        Set cache to keep the terms in the vocabulary cache, see cached_step().
         """
+        if cache:
+            return cls.cached_step(
+                'hyphenate_terms', other, {}, lambda: cls.hyphenate_terms(other))
+
         terms = []
-        for term in other.terms:
+        for term in other:
 
             if term.get('hyphenate'):
                 # Handle a non-standard hyphenation
@@ -164,28 +318,35 @@ class Csv:
                         'attr': term['attr'],
                         'replace': replace if replace else term['pattern'],
                     }})
-        return cls(terms=terms)
+        return cls(terms=terms)._derived('hyphenate_terms', other, {})
 
     @classmethod
-    def trailing_dash(cls, other: 'Csv', label: str) -> 'Csv':
+    def trailing_dash(cls, other: 'Csv', label: str, cache: bool = False) -> 'Csv':
         """Systematically handle hyphenated terms.
 
         We cannot depend on terms being present in a contiguous form. We need a
         systematic method for handling hyphenated terms. The hyphenate library is
         great for this but sometimes we need to handle non-standard hyphenations
         manually. Non-standard hyphenations are stored in the terms CSV file.
+
+        Set cache to keep the terms in the vocabulary cache, see cached_step().
         """
+        params = {'label': label}
+        if cache:
+            return cls.cached_step(
+                'trailing_dash', other, params, lambda: cls.trailing_dash(other, label))
+
         terms = []
-        for term in other.terms:
+        for term in other.with_label(label):
             pattern = term['pattern']
-            if term.get('label') == label and pattern[-1] not in DASH_CHAR:
+            if pattern[-1] not in DASH_CHAR:
                 replace = term.get('replace')
                 for dash in DASH_CHAR:
                     terms.append({**term, **{
                         'pattern': pattern + dash,
                         'replace': replace if replace else pattern,
                     }})
-        return cls(terms=terms)
+        return cls(terms=terms)._derived('trailing_dash', other, params)
 
     @classmethod
     def pick_words(
@@ -194,19 +355,34 @@ class Csv:
             old_label: str,
             idx: Union[int, list[int], tuple[int]],
             new_label: str = None,
-            attr: str = 'lower'
+            attr: str = 'lower',
+            cache: bool = False,
     ) -> 'Csv':
         """Create a new term by picking a words from an old term.
 
         Used to get species or genus names like: 'Canis lupus' -> 'lupus'.
+        Set cache to keep the terms in the vocabulary cache, see cached_step().
         """
         terms = []
         idx = (idx, idx + 1) if isinstance(idx, int) else idx
         new_label = new_label if new_label else old_label
 
+        params = {
+            'old_label': old_label,
+            'idx': list(idx),
+            'new_label': new_label,
+            'attr': attr,
+        }
+        if cache:
+            return cls.cached_step(
+                'pick_words',
+                other,
+                params,
+                lambda: cls.pick_words(other, old_label, idx, new_label, attr))
+
         used_patterns = set()
 
-        for term in [t for t in other.terms if t['label'] == old_label]:
+        for term in other.with_label(old_label):
             words = term['pattern'].split()
 
             if len(words) >= idx[1]:
@@ -219,32 +395,55 @@ class Csv:
                         'attr': attr,
                     }})
                     used_patterns.add(pattern)
-        return cls(terms=terms)
+        return cls(terms=terms)._derived('pick_words', other, params)
 
     @classmethod
     def abbrev_terms(
-            cls, other: 'Csv', label: str, idx: int = 0, attr='lower', suffix='.'
+            cls,
+            other: 'Csv',
+            label: str,
+            idx: int = 0,
+            attr='lower',
+            suffix='.',
+            cache: bool = False,
     ) -> 'Csv':
         """Create an abbreviated term from another term.
 
         For example an abbreviated species: 'Canis lupus' -> 'C. lupus'.
+        Set cache to keep the terms in the vocabulary cache, see cached_step().
         """
+        params = {'label': label, 'idx': idx, 'attr': attr, 'suffix': suffix}
+        if cache:
+            return cls.cached_step(
+                'abbrev_terms',
+                other,
+                params,
+                lambda: cls.abbrev_terms(other, label, idx, attr, suffix))
+
         terms = []
         used_patterns = set()
 
-        for term in other.terms:
-            if term['label'] == label:
-                old_pattern = term['pattern']
-                words = old_pattern.split()
-                if len(words) > idx and words[idx][-1] != suffix:
-                    words[idx] = words[idx][0] + suffix
-                    new_pattern = ' '.join(words)
-                    if new_pattern not in used_patterns:
-                        terms.append({**term, **{
-                            'label': label,
-                            'pattern': new_pattern,
-                            'attr': attr,
-                            'replace': old_pattern,
-                        }})
-                        used_patterns.add(new_pattern)
-        return cls(terms=terms)
+        for term in other.with_label(label):
+            old_pattern = term['pattern']
+            words = old_pattern.split()
+            if len(words) > idx and words[idx][-1] != suffix:
+                words[idx] = words[idx][0] + suffix
+                new_pattern = ' '.join(words)
+                if new_pattern not in used_patterns:
+                    terms.append({**term, **{
+                        'label': label,
+                        'pattern': new_pattern,
+                        'attr': attr,
+                        'replace': old_pattern,
+                    }})
+                    used_patterns.add(new_pattern)
+        return cls(terms=terms)._derived('abbrev_terms', other, params)
+
+
+def as_paths(paths: PathList) -> list[Path]:
+    """Convert the paths argument into a list of paths."""
+    if isinstance(paths, str):
+        paths = paths.split()
+    elif isinstance(paths, Path):
+        paths = [paths]
+    return [Path(p) for p in paths]
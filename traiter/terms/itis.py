@@ -1,9 +1,19 @@
-"""Get terms from an SQLite ITIS database."""
+"""Get terms from an SQLite ITIS database.
+
+Finding all of the taxa under a taxon means searching the hierarchy strings for the
+taxon's TSN. This requires a full table scan so you should run Itis.build_index()
+once after downloading the database. It adds a closure table with a row for every
+ancestor/descendant pair which turns these searches into indexed joins.
+"""
 
 import csv
+import os
 import sqlite3
+import threading
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
-from typing import Optional, Union
+from typing import Iterable, Iterator, Optional, Union
 
 from .csv_ import Csv
 from ..const import DATA_DIR
@@ -11,13 +21,146 @@ from ..const import DATA_DIR
 # This points to a database (or a sym link) in the client's data directory
 ITIS_DB = DATA_DIR / 'ITIS.sqlite'
 
+# The closure table that we add to the ITIS database
+CLOSURE = 'traiter_closure'
+
+# Pooled read-only connections
+CONNECTIONS: dict[tuple[str, int, int], sqlite3.Connection] = {}
+
+# SQLite limits the number of parameters in a query
+CHUNK = 400
+
+SELECT_TSNS = """
+    select unit_name1, min(tsn)
+      from taxonomic_units
+     where unit_name1 in ({})
+  group by unit_name1;
+    """
+
+SELECT_BATCH = f"""
+    with wanted (pos, ancestor) as (values {{}})
+    select pos, complete_name, vernacular_name
+      from wanted
+      join {CLOSURE} using (ancestor)
+      join taxonomic_units using (tsn)
+ left join vernaculars using (tsn)
+     where kingdom_id = ?
+       and rank_id = ?
+  order by pos, complete_name;
+    """
+
+SELECT_BATCH_SCAN = """
+    select complete_name, vernacular_name
+      from hierarchy
+      join taxonomic_units using (tsn)
+ left join vernaculars using (tsn)
+     where hierarchy_string like ?
+       and kingdom_id = ?
+       and rank_id = ?
+  order by complete_name;
+    """
+
+SELECT_NAMES = {
+    'closure': f"""
+        select complete_name
+          from {CLOSURE}
+          join taxonomic_units using (tsn)
+         where ancestor = ?
+           and kingdom_id = ?
+           and rank_id = ?;
+        """,
+    'scan': """
+        select complete_name
+          from hierarchy
+          join taxonomic_units using (tsn)
+         where hierarchy_string like ?
+           and kingdom_id = ?
+           and rank_id = ?;
+        """,
+}
+
+SELECT_COMMON_NAMES = {
+    'closure': f"""
+        select vernacular_name, complete_name
+          from {CLOSURE}
+          join vernaculars using (tsn)
+          join taxonomic_units using (tsn)
+         where ancestor = ?
+           and kingdom_id = ?
+           and rank_id = ?
+      order by complete_name;
+        """,
+    'scan': """
+        select vernacular_name, complete_name
+          from vernaculars
+          join taxonomic_units using (tsn)
+          join hierarchy using (tsn)
+         where hierarchy_string like ?
+           and kingdom_id = ?
+           and rank_id = ?
+      order by complete_name;
+        """,
+}
+
 
 class Itis(Csv):
     """A dictionary of temp."""
 
+    @staticmethod
+    def build_index(db: Union[str, Path] = ITIS_DB) -> None:
+        """Add a closure table of every ancestor/descendant pair to the database.
+
+        This is a one-time step after downloading the database. The hierarchy
+        strings look like "202422-846494-...-180543" and a taxon has as its
+        ancestors all of the TSNs between the first and the last one.
+        """
+        with sqlite3.connect(db) as cxn:
+            cxn.executescript(f"""
+                drop table if exists {CLOSURE};
+                create table {CLOSURE} (
+                    ancestor integer,
+                    tsn integer,
+                    primary key (ancestor, tsn)
+                ) without rowid;
+                create index if not exists {CLOSURE}_tsn on {CLOSURE} (tsn);
+                create index if not exists taxonomic_units_unit_name1
+                    on taxonomic_units (unit_name1);
+                """)
+            rows = cxn.execute('select tsn, hierarchy_string from hierarchy')
+            pairs = ((int(a), t) for t, h in rows for a in h.split('-')[1:-1])
+            cxn.executemany(f'insert or ignore into {CLOSURE} values (?, ?)', pairs)
+        species_names.cache_clear()
+        common_names.cache_clear()
+
     ###########################################################################
     # Other constructors related to the ITIS database
 
+    # pylint: disable=too-many-arguments
+    @classmethod
+    def itis_batch(
+            cls,
+            taxa: list[str],
+            labels: Optional[dict[str, str]] = None,
+            kingdom_id: int = 5,
+            rank_id: int = 220,
+            attr: str = 'lower',
+            replace: bool = False,
+    ) -> 'Itis':
+        """Get species and common names for several taxa at once.
+
+        This gets the same terms as calling Itis.itis and Itis.itis_common_names
+        for each taxon but it does it with a single pass over the database.
+
+        taxa       = the taxa to get terms for, these are often family names
+        labels     = the label to use for each taxon's species, default = the taxon
+        kingdom_id = 5 == Animalia
+        rank_id    = 220 == Species
+        attr       = the spacy attribute to match on
+        replace    = replace common names with the scientific name
+        """
+        terms = iter_itis(taxa, labels, kingdom_id, rank_id, attr, replace)
+        return cls(terms=list(terms))
+
     @classmethod
     def itis(
             cls,
@@ -38,21 +181,7 @@ class Itis(Csv):
 
         label = label if label else taxon
 
-        tsn = """ select tsn from taxonomic_units where unit_name1 = ?; """
-        names = """
-            select complete_name
-              from hierarchy
-              join taxonomic_units using (tsn)
-             where hierarchy_string like ?
-               and kingdom_id = ?
-               and rank_id = ?;
-               """
-
-        with sqlite3.connect(ITIS_DB) as cxn:
-            cursor = cxn.execute(tsn, (taxon,))
-            tsn = cursor.fetchone()[0]
-            mask = f'%-{tsn}-%'
-            taxa = {n[0] for n in cxn.execute(names, (mask, kingdom_id, rank_id))}
+        taxa = set(species_names(str(ITIS_DB), taxon, kingdom_id, rank_id))
 
         terms += [{'label': label, 'pattern': t, 'attr': attr, 'pos': 'PROPN'}
                   for t in sorted(taxa)]
@@ -89,30 +218,17 @@ class Itis(Csv):
     ) -> 'Itis':
         """Guides often use common names instead of scientific name.
 
+        When several species share a common name it is replaced with the first of
+        their scientific names in alphabetical order, the same as Itis.itis_batch.
+
         kingdom_id =   5 == Animalia
         rank_id    = 220 == Species
         """
         terms = []
 
-        select_tsn = """ select tsn from taxonomic_units where unit_name1 = ?; """
-        select_names = """
-            select vernacular_name, complete_name
-              from vernaculars
-              join taxonomic_units using (tsn)
-              join hierarchy using (tsn)
-             where hierarchy_string like ?
-               and kingdom_id = ?
-               and rank_id = ?;
-            """
-
-        with sqlite3.connect(ITIS_DB) as cxn:
-            cursor = cxn.execute(select_tsn, (taxon,))
-            tsn = cursor.fetchone()[0]
-            mask = f'%-{tsn}-%'
-            names = {
-                n[0].lower(): n[1]
-                for n in cxn.execute(select_names, (mask, kingdom_id, rank_id))
-            }
+        names = {}
+        for common, sci_name in common_names(str(ITIS_DB), taxon, kingdom_id, rank_id):
+            names.setdefault(common.lower(), sci_name)
 
         for common, sci_name in names.items():
             term = {
@@ -148,3 +264,147 @@ class Itis(Csv):
             term['label'] = label if label else taxon
 
         return cls(terms=terms)
+
+
+def connect(db: Union[str, Path] = ITIS_DB) -> sqlite3.Connection:
+    """Get a pooled read-only connection to the database.
+
+    Connections cannot be shared between threads or across a fork so there is one
+    per database per thread and process.
+    """
+    key = (str(db), os.getpid(), threading.get_ident())
+    if key not in CONNECTIONS:
+        uri = Path(db).resolve().as_uri() + '?mode=ro'
+        CONNECTIONS[key] = sqlite3.connect(uri, uri=True)
+    return CONNECTIONS[key]
+
+
+def has_index(cxn: sqlite3.Connection) -> bool:
+    """Check if the closure table has been added to the ITIS database."""
+    sql = """ select 1 from sqlite_master where type = 'table' and name = ?; """
+    return cxn.execute(sql, (CLOSURE,)).fetchone() is not None
+
+
+def query_taxon(
+        cxn: sqlite3.Connection,
+        queries: dict,
+        taxon: str,
+        kingdom_id: int,
+        rank_id: int,
+) -> list[tuple]:
+    """Run a query for all taxa under the given taxon.
+
+    The taxon's TSN is found the same way as in the batch queries, so homonyms
+    resolve to the same taxon both ways.
+    """
+    tsn = get_tsns(cxn, [taxon])[taxon]
+    if has_index(cxn):
+        return cxn.execute(queries['closure'], (tsn, kingdom_id, rank_id)).fetchall()
+    mask = f'%-{tsn}-%'
+    return cxn.execute(queries['scan'], (mask, kingdom_id, rank_id)).fetchall()
+
+
+@lru_cache(maxsize=None)
+def species_names(db: str, taxon: str, kingdom_id: int, rank_id: int) -> tuple[str]:
+    """Get the complete names of all taxa under the taxon, memoized."""
+    rows = query_taxon(connect(db), SELECT_NAMES, taxon, kingdom_id, rank_id)
+    return tuple(r[0] for r in rows)
+
+
+@lru_cache(maxsize=None)
+def common_names(
+        db: str, taxon: str, kingdom_id: int, rank_id: int
+) -> tuple[tuple[str, str]]:
+    """Get the (common name, complete name) of all taxa under the taxon, memoized.
+
+    The rows are sorted by the complete name.
+    """
+    rows = query_taxon(connect(db), SELECT_COMMON_NAMES, taxon, kingdom_id, rank_id)
+    return tuple(rows)
+
+
+def get_tsns(cxn: sqlite3.Connection, taxa: list[str]) -> dict[str, int]:
+    """Look up the TSNs for all of the taxa.
+
+    A name may be used by several taxa in different kingdoms. We always take the
+    one with the lowest TSN.
+    """
+    tsns = {}
+    it = iter(dict.fromkeys(taxa))
+    while chunk := list(islice(it, CHUNK)):
+        sql = SELECT_TSNS.format(', '.join(['?'] * len(chunk)))
+        tsns |= dict(cxn.execute(sql, chunk))
+
+    if missing := [t for t in taxa if t not in tsns]:
+        raise ValueError(f'Taxa not found in ITIS: {", ".join(missing)}')
+
+    return tsns
+
+
+# pylint: disable=too-many-arguments
+def iter_itis(
+        taxa: Iterable[str],
+        labels: Optional[dict[str, str]] = None,
+        kingdom_id: int = 5,
+        rank_id: int = 220,
+        attr: str = 'lower',
+        replace: bool = False,
+        db: Union[str, Path, None] = None,
+) -> Iterator[dict]:
+    """Stream species and common name terms for several taxa from the database.
+
+    Species terms for each taxon come out in the order of the taxa and sorted by
+    name. A common name term is yielded the first time we see it. So a common name
+    shared by several species is replaced with the first of their names in
+    alphabetical order under the first taxon, like Itis.itis_common_names.
+    """
+    taxa = list(taxa)
+    labels = labels if labels else {}
+    cxn = connect(db if db else ITIS_DB)
+    tsns = get_tsns(cxn, taxa)
+
+    seen_names, seen_commons = set(), set()
+    for pos, name, common in _batch_rows(cxn, taxa, tsns, kingdom_id, rank_id):
+        taxon = taxa[pos]
+        if (pos, name) not in seen_names:
+            seen_names.add((pos, name))
+            yield {
+                'label': labels.get(taxon, taxon),
+                'pattern': name,
+                'attr': attr,
+                'pos': 'PROPN',
+            }
+
+        if common and (common := common.lower()) not in seen_commons:
+            seen_commons.add(common)
+            term = {
+                'label': 'common_name',
+                'pattern': common,
+                'attr': 'lower',
+                'pos': 'PROPN',
+            }
+            if replace:
+                term['replace'] = name
+            yield term
+
+
+def _batch_rows(
+        cxn: sqlite3.Connection,
+        taxa: list[str],
+        tsns: dict[str, int],
+        kingdom_id: int,
+        rank_id: int,
+) -> Iterator[tuple[int, str, Optional[str]]]:
+    """Get (taxon position, complete name, vernacular name) rows for the taxa."""
+    if not has_index(cxn):
+        for pos, taxon in enumerate(taxa):
+            mask = f'%-{tsns[taxon]}-%'
+            for row in cxn.execute(SELECT_BATCH_SCAN, (mask, kingdom_id, rank_id)):
+                yield pos, *row
+        return
+
+    for start in range(0, len(taxa), CHUNK):
+        chunk = taxa[start:start + CHUNK]
+        sql = SELECT_BATCH.format(', '.join(['(?, ?)'] * len(chunk)))
+        params = [v for i, t in enumerate(chunk, start) for v in (i, tsns[t])]
+        yield from cxn.execute(sql, (*params, kingdom_id, rank_id))
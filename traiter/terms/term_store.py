@@ -0,0 +1,139 @@
+"""Hold vocabulary terms with hash indexes on the fields we look them up by.
+
+The Csv class does most of its work by looking up terms by label, pattern, or
+attr. With hundreds of thousands of terms a linear scan for every lookup gets
+expensive so we keep an index for each of these fields.
+
+The store is a list, so code that reads or changes Csv.terms like a list still
+works. Appending terms updates the indexes. Any other change to the list, like a
+deletion or a sort, marks the indexes as stale and they are rebuilt on the next
+lookup.
+
+Terms are dicts and are held by reference. If you change an indexed field in a
+term after adding it you must reindex the store.
+
+The store counts its changes in its version, so Csv can tell when a term set no
+longer matches the recipe it was built with.
+"""
+
+from collections import defaultdict
+from typing import Any, Callable, Iterable, Optional
+
+INDEXED = ('label', 'pattern', 'attr')
+
+# How we normalize a field value before indexing it
+KEYS: dict[str, Callable[[Any], Any]] = {
+    'attr': lambda v: v.upper() if isinstance(v, str) else v,
+}
+
+# The terms with each value of a field, in list order
+Index = dict[Any, list[dict]]
+
+
+def stale(method: Callable) -> Callable:
+    """Wrap a list method so that it marks the indexes as stale."""
+
+    def _method(self, *args, **kwargs):
+        self._indexes = None
+        self.version += 1
+        return method(self, *args, **kwargs)
+
+    _method.__name__ = method.__name__
+    _method.__doc__ = method.__doc__
+    return _method
+
+
+class TermStore(list):
+    """A list of terms with indexes on some fields."""
+
+    __slots__ = ('_indexes', 'version')
+
+    def __init__(self, terms: Optional[Iterable[dict]] = None) -> None:
+        super().__init__(terms if terms else [])
+        self._indexes: Optional[dict[str, Index]] = None
+        self.version = 0  # How many times the store has changed
+
+    def __reduce__(self) -> tuple:
+        return self.__class__, (list(self),)
+
+    def append(self, term: dict) -> None:
+        """Add a term to the store and index it."""
+        super().append(term)
+        self.version += 1
+        if self._indexes is not None:
+            for field, index in self._indexes.items():
+                index[self.key(field, term.get(field))].append(term)
+
+    def extend(self, terms: Iterable[dict]) -> None:
+        """Add several terms to the store."""
+        for term in terms:
+            self.append(term)
+
+    def __iadd__(self, terms: Iterable[dict]) -> 'TermStore':
+        self.extend(terms)
+        return self
+
+    __setitem__ = stale(list.__setitem__)
+    __delitem__ = stale(list.__delitem__)
+    __imul__ = stale(list.__imul__)
+    insert = stale(list.insert)
+    pop = stale(list.pop)
+    remove = stale(list.remove)
+    clear = stale(list.clear)
+    sort = stale(list.sort)
+    reverse = stale(list.reverse)
+
+    def find(self, field: str, value: Any) -> list[dict]:
+        """Get all terms where the field has the given value, in list order."""
+        if field in INDEXED:
+            return list(self.indexes[field].get(self.key(field, value), []))
+        return [t for t in self if t.get(field) == value]
+
+    def drop(self, field: str, values: Iterable[Any]) -> None:
+        """Remove all terms where the field has one of the values."""
+        keys = {self.key(field, v) for v in values}
+        if field in INDEXED:
+            index = self.indexes[field]
+            dropped = [t for k in keys for t in index.get(k, [])]
+        else:
+            dropped = [t for t in self if t.get(field) in keys]
+
+        if not dropped:
+            return
+
+        # Remove the terms from the list and the indexes without a full reindex
+        gone = {id(t) for t in dropped}
+        self.version += 1
+        super().__setitem__(slice(None), [t for t in self if id(t) not in gone])
+        if self._indexes is None:
+            return
+        for name, index in self._indexes.items():
+            for key in {self.key(name, t.get(name)) for t in dropped}:
+                if kept := [t for t in index[key] if id(t) not in gone]:
+                    index[key] = kept
+                else:
+                    del index[key]
+
+    @property
+    def indexes(self) -> dict[str, Index]:
+        """Get the indexes, building them if they are stale."""
+        if self._indexes is None:
+            self._build_indexes()
+        return self._indexes
+
+    def reindex(self) -> None:
+        """Rebuild the indexes after the fields of some terms were changed."""
+        self.version += 1
+        self._build_indexes()
+
+    def _build_indexes(self) -> None:
+        self._indexes = {f: defaultdict(list) for f in INDEXED}
+        for term in self:
+            for field, index in self._indexes.items():
+                index[self.key(field, term.get(field))].append(term)
+
+    @staticmethod
+    def key(field: str, value: Any) -> Any:
+        """Normalize a field value for the index."""
+        func = KEYS.get(field)
+        return func(value) if func else value
@@ -0,0 +1,138 @@
+"""Cache fully expanded vocabularies on disk.
+
+Building a vocabulary means reading the CSV files and then expanding the terms with
+functions like hyphenate_terms, trailing_dash, pick_words, and abbrev_terms. This is
+done every time a process starts, so we save the finished term list to disk.
+
+A cache file is keyed on the content of its source files and on the parameters used
+to build it. So editing a source file, or changing how it is expanded, will create a
+new cache file rather than reading a stale one. The parameters must be JSON values
+so that the same build gets the same key in every process.
+
+The file layout is:
+    magic    = b'TRVC'
+    version  = 4-byte unsigned int
+    size     = 8-byte unsigned int, the size of the header
+    header   = pickled dict with the label blocks and the term order
+    blocks   = one zlib compressed pickle of a term list per label
+
+The terms are stored one block per label so that we only have to unpickle the labels
+a pipeline asks for.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import struct
+import zlib
+from array import array
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Any, Iterable, Optional, Union
+
+from ..const import DATA_DIR
+
+# This points to a cache directory in the client's data directory
+VOCAB_CACHE_DIR = DATA_DIR / 'vocab_cache'
+
+MAGIC = b'TRVC'
+VERSION = 1
+PREFIX = struct.Struct('<4sIQ')
+
+PathLike = Union[str, Path]
+
+
+def cache_key(paths: Iterable[PathLike], params: Optional[dict] = None) -> str:
+    """Build a cache key from the source file contents and the build parameters.
+
+    The parameters must be JSON values, anything else raises a TypeError.
+    """
+    digest = hashlib.sha256(f'{VERSION}'.encode())
+
+    for path in paths:
+        with open(path, 'rb') as in_file:
+            digest.update(hashlib.sha256(in_file.read()).digest())
+
+    params = params if params else {}
+    digest.update(json.dumps(params, sort_keys=True).encode())
+
+    return digest.hexdigest()
+
+
+def cache_path(key: str, cache_dir: Optional[PathLike] = None) -> Path:
+    """Get the path to the cache file for the key."""
+    cache_dir = Path(cache_dir) if cache_dir else VOCAB_CACHE_DIR
+    return cache_dir / f'{key}.vocab'
+
+
+def write(path: PathLike, terms: Iterable[dict]) -> None:
+    """Write terms to a cache file.
+
+    The file is written to a temporary file first and then moved into place so that
+    readers never see a partially written cache.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    by_label: dict[Any, list[dict]] = {}
+    order = array('I')
+    label_ids = {}
+    for term in terms:
+        label = term.get('label')
+        if label not in label_ids:
+            label_ids[label] = len(label_ids)
+            by_label[label] = []
+        by_label[label].append(term)
+        order.append(label_ids[label])
+
+    blocks, offset, index = [], 0, {}
+    for label, label_terms in by_label.items():
+        block = zlib.compress(pickle.dumps(label_terms, pickle.HIGHEST_PROTOCOL))
+        index[label] = (label_ids[label], offset, len(block))
+        blocks.append(block)
+        offset += len(block)
+
+    header = {'labels': index, 'order': zlib.compress(order.tobytes())}
+    header = pickle.dumps(header, pickle.HIGHEST_PROTOCOL)
+
+    with NamedTemporaryFile('wb', dir=path.parent, delete=False) as out_file:
+        out_file.write(PREFIX.pack(MAGIC, VERSION, len(header)))
+        out_file.write(header)
+        for block in blocks:
+            out_file.write(block)
+    os.replace(out_file.name, path)
+
+
+def read(path: PathLike, labels: Optional[list[str]] = None) -> Optional[list[dict]]:
+    """Read terms from a cache file, optionally only the given labels.
+
+    Returns None if there is no usable cache file.
+    """
+    try:
+        with open(path, 'rb') as in_file:
+            magic, version, size = PREFIX.unpack(in_file.read(PREFIX.size))
+            if magic != MAGIC or version != VERSION:
+                return None
+
+            header = pickle.loads(in_file.read(size))
+            start = PREFIX.size + size
+
+            index = header['labels']
+            wanted = [lb for lb in index if labels is None or lb in labels]
+
+            blocks = {}
+            for label in sorted(wanted, key=lambda lb: index[lb][1]):
+                label_id, offset, length = index[label]
+                in_file.seek(start + offset)
+                block = zlib.decompress(in_file.read(length))
+                blocks[label_id] = iter(pickle.loads(block))
+
+    except (OSError, EOFError, KeyError, struct.error, zlib.error,
+            pickle.UnpicklingError):
+        return None
+
+    # Put the terms back into their original order
+    order = array('I')
+    order.frombytes(zlib.decompress(header['order']))
+    return [next(blocks[i]) for i in order if i in blocks]
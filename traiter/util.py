@@ -1,19 +1,41 @@
 """Misc. utilities shared between client Traiters."""
 
+import multiprocessing
 import os
+from collections import deque
 from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache, partial
+from itertools import islice
 from pathlib import Path
 from shutil import rmtree
 from tempfile import TemporaryDirectory, mkdtemp
-from typing import Any, Hashable, Optional, Union
+from typing import Any, Callable, Hashable, Iterable, Iterator, Optional, Union
 
 import ftfy
 import inflect
+import numpy as np
 import regex as re
 
 INFLECT = inflect.engine()
 
+# Text with any character outside of printable ASCII, tab, and newlines, or with an
+# "&" for HTML entities, may need ftfy. Other text cannot be changed by ftfy.
+NEEDS_FTFY = re.compile(r'[^\t\n\r\x20-\x25\x27-\x7e]')
+
+CLEAN_CHUNK = 1_000  # How many texts to send to a worker at a time
+MEMO_SIZE = 100_000  # How many cleaned texts to remember
+
+# For to_positive_float() and to_positive_int() and their batch versions
+NOT_NUMBER = re.compile(r'[^\d./]')
+TRAILING_DOT = re.compile(r'\.$')
+POSITIVE_FLOAT = re.compile(r'\d+\.?\d*|\.\d+')  # What float() accepts after cleaning
+POSITIVE_INT = re.compile(r'\d+')  # What int() accepts after cleaning
+INT64_DIGITS = 18  # Any number with this many digits fits in an int64
+
+# The clean function in a worker process
+WORKER_CLEAN: Optional[Callable[[str], str]] = None
+
 
 class DotDict(dict):
     """Allow dot.notation access to dictionary items."""
@@ -102,7 +124,7 @@ def as_member(values: Any) -> Hashable:
 
 def to_positive_float(value: str):
     """Convert the value to a float."""
-    value = re.sub(r'[^\d./]', '', value) if value else ''
+    value = NOT_NUMBER.sub('', value) if value else ''
     try:
         return float(value)
     except ValueError:
@@ -111,14 +133,43 @@ def to_positive_float(value: str):
 
 def to_positive_int(value: str):
     """Convert the value to an integer."""
-    value = re.sub(r'[^\d./]', '', value) if value else ''
-    value = re.sub(r"\.$", '', value)
+    value = NOT_NUMBER.sub('', value) if value else ''
+    value = TRAILING_DOT.sub('', value)
     try:
         return int(value)
     except ValueError:
         return None
 
 
+def to_positive_floats(values: Iterable[str]) -> np.ndarray:
+    """Convert the values like to_positive_float(), with NaN where it gives None."""
+    cleaned = [NOT_NUMBER.sub('', v) if v else '' for v in values]
+    good = np.array([bool(POSITIVE_FLOAT.fullmatch(v)) for v in cleaned], dtype=bool)
+    floats = np.full(len(cleaned), np.nan)
+    if good.any():
+        kept = [v for v, ok in zip(cleaned, good) if ok]
+        floats[good] = np.array(kept).astype(np.float64)
+    return floats
+
+
+def to_positive_ints(values: Iterable[str]) -> np.ma.MaskedArray:
+    """Convert the values like to_positive_int(), masked where it gives None.
+
+    The array has an object dtype if a value is too big for an int64.
+    """
+    cleaned = [TRAILING_DOT.sub('', NOT_NUMBER.sub('', v)) if v else '' for v in values]
+    good = np.array([bool(POSITIVE_INT.fullmatch(v)) for v in cleaned], dtype=bool)
+    kept = [v for v, ok in zip(cleaned, good) if ok]
+    if any(len(v) > INT64_DIGITS for v in kept):
+        ints = np.zeros(len(cleaned), dtype=object)
+        ints[good] = [int(v) for v in kept]
+    else:
+        ints = np.zeros(len(cleaned), dtype=np.int64)
+        if kept:
+            ints[good] = np.array(kept).astype(np.int64)
+    return np.ma.masked_array(ints, mask=~good)
+
+
 def camel_to_snake(name: str) -> str:
     """Convert a camel case string to snake case."""
     split = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
@@ -144,11 +195,59 @@ def clean_text(text: str, trans: Optional[str.translate] = None) -> str:
     # text = ' '.join(text.split())  # Space normalize
     # Join hyphenated words when they are at the end of a line
     # text = re.sub(r'([a-z])-\s+([a-z])', r'\1\2', text, flags=re.IGNORECASE)
-    text = ftfy.fix_text(text)  # Handle common mojibake
+    if NEEDS_FTFY.search(text):
+        text = ftfy.fix_text(text)  # Handle common mojibake
     text = re.sub(r'\p{Cc}+', ' ', text)  # Remove control characters
     return text
 
 
+def clean_texts(
+        texts: Iterable[str],
+        trans: Optional[dict] = None,
+        workers: int = 1,
+        memo: bool = False,
+        chunksize: int = CLEAN_CHUNK,
+) -> Iterator[str]:
+    """Clean many texts, in order, with clean_text().
+
+    texts     = An iterable of strings, it is consumed lazily
+    trans     = A translation table passed to clean_text()
+    workers   = The number of worker processes. 1 = clean in this process
+    memo      = Remember recently cleaned texts, for inputs with many repeats
+    chunksize = How many texts to send to a worker at a time
+    """
+    if workers <= 1:
+        yield from map(cleaner(trans, memo), texts)
+        return
+
+    texts = iter(texts)
+    with multiprocessing.Pool(workers, init_clean_worker, (trans, memo)) as pool:
+        pending = deque()
+        while chunk := list(islice(texts, chunksize)):
+            pending.append(pool.apply_async(clean_chunk, (chunk,)))
+            if len(pending) >= 2 * workers:  # Bound the work in flight
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def cleaner(trans: Optional[dict] = None, memo: bool = False) -> Callable[[str], str]:
+    """Get a clean_text() function for the options."""
+    clean = partial(clean_text, trans=trans)
+    return lru_cache(maxsize=MEMO_SIZE)(clean) if memo else clean
+
+
+def init_clean_worker(trans: Optional[dict], memo: bool) -> None:
+    """Set up the clean function once per worker process."""
+    global WORKER_CLEAN  # pylint: disable=global-statement
+    WORKER_CLEAN = cleaner(trans, memo)
+
+
+def clean_chunk(chunk: list[str]) -> list[str]:
+    """Clean a chunk of texts in a worker process."""
+    return [WORKER_CLEAN(t) for t in chunk]
+
+
 def xor(one: Any, two: Any) -> bool:
     """Emulate a logical xor."""
     return (one and two) or (not one and not two)